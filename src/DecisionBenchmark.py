@@ -0,0 +1,290 @@
+#
+#    ___          _     _            __  ___     __          	 /\_______/\
+#   / _ \___ ____(_)__ (_)__  ___   /  |/  /__ _/ /_____ ____ 	 /_  ___   \
+#  / // / -_) __/ (_-</ / _ \/ _ \ / /|_/ / _ `/  '_/ -_) __/	/ @\/ @ \   \
+# /____/\__/\__/_/___/_/\___/_//_//_/  /_/\_,_/_/\_\\__/_/   	\__/\___/   /
+#																 \_\/______/
+#  DecisionBenchmark.py											 /     /\\\\\ 
+#  Dylan Everingham for Marissa Kohan							|      \\\\\\\ 
+#																 \      \\\\\\\ 
+#																  \______/\\\\\
+#																	_||_||_
+
+
+#
+# Benchmarks of DecisionMaker app backend over synthetic databases of increasing size
+# Reports throughput, p50/p99 latency and peak memory of loading, scoring and choosing.
+#	Results can be saved as a baseline, and later runs compared against it
+# Run with: python DecisionBenchmark.py [--sizes N ...] [--save FILE] [--compare FILE]
+
+# Dependencies
+import os
+import sys
+import csv
+import json
+import time
+import random
+import argparse
+import tempfile
+import itertools
+import tracemalloc
+from DecisionMaker import *
+
+# Constants
+TEMPLATE_DB_PATH = '../data/Possibilities.csv'
+DEFAULT_SIZES = [100, 1000, 10000, 100000, 1000000]
+BENCHMARKS = ['load', 'inLimits', 'getProb', 'getWeights', 'choose', 'chooseCached', 'chooseMany']
+
+# Seconds spent timing each benchmark. Every benchmark makes at least one call per query
+DEFAULT_DURATION = 0.5
+
+# Number of distinct queries per benchmark
+NUM_QUERIES = 1000
+
+# Number of times each benchmark is timed. The run with the lowest median latency is kept,
+#	since slower runs are slowed down by something else on the machine
+DEFAULT_REPEAT = 3
+
+# Relative slowdown (or memory growth) over the baseline which counts as a regression
+DEFAULT_TOLERANCE = 0.25
+
+# Function to write a synthetic database with the same layout as the real one.
+#	Each row copies the limits and weights of a random real row, with a new message and base weight
+# Arguments:
+#	db_fname: name of database file to write
+#	num_rows: number of rows
+#	seed: random seed
+#	template_fname: real database file to copy rows from
+def generateDatabase(db_fname, num_rows, seed=0, template_fname=TEMPLATE_DB_PATH):
+	templates = [values for line, message, values in \
+		parseDatabaseRows(readDatabaseLines(template_fname), template_fname, LoadReport())]
+	rng = random.Random(seed)
+	num_messages = max(1, num_rows // 4)
+	tmp_fname = db_fname + '.tmp'
+	with open(tmp_fname, 'w', newline='') as fptr:
+		writer = csv.writer(fptr, delimiter='\t', lineterminator='\n')
+		writer.writerow(['# Synthetic database of {} rows copied from {}'.format(num_rows, template_fname)])
+		for i in range(num_rows):
+			values = list(rng.choice(templates))
+			values[0] = rng.randint(1, 10)
+			writer.writerow(['Message {}'.format(rng.randrange(num_messages))] + values)
+	os.replace(tmp_fname, db_fname)
+
+# Function to get a synthetic database, generating it if it doesn't exist yet
+# Arguments:
+#	data_dir: directory synthetic databases are kept in
+#	num_rows: number of rows
+#	seed: random seed
+# Return values:
+#	db_fname: name of database file
+def getDatabase(data_dir, num_rows, seed=0):
+	os.makedirs(data_dir, exist_ok=True)
+	db_fname = os.path.join(data_dir, 'synthetic-{}-{}.csv'.format(num_rows, seed))
+	if not os.path.exists(db_fname):
+		generateDatabase(db_fname, num_rows, seed)
+	return db_fname
+
+# Function to make queries for a database. Most fall within the limits of some row,
+#	the rest are random, like real queries
+# Arguments:
+#	decision_maker: DecisionMaker holding the database
+#	num_queries: number of queries
+#	seed: random seed
+# Return values:
+#	queries: list of Parameters
+def makeQueries(decision_maker, num_queries, seed=0):
+	rng = random.Random(seed)
+	possibilities = decision_maker.possibilities
+	queries = []
+	for i in range(num_queries):
+		if (rng.random() < 0.8):
+			limits = possibilities[rng.randrange(len(possibilities))].param_limits
+			queries.append(Parameters(*[rng.randint(low, max(low, high)) for low, high in limits]))
+		else:
+			queries.append(Parameters(*[rng.randint(-5, 23) for field in Parameter_Fields]))
+	return queries
+
+# Function to time calls of a function
+# Arguments:
+#	function: function to call
+#	args_list: list of argument tuples. Calls cycle through them
+#	duration: seconds to keep calling for, after calling once with each argument tuple
+# Return values:
+#	latencies: list of seconds taken by each call
+def timeCalls(function, args_list, duration):
+	latencies = []
+	start = time.perf_counter()
+	for args in itertools.cycle(args_list):
+		call_start = time.perf_counter()
+		function(*args)
+		latencies.append(time.perf_counter() - call_start)
+		if (len(latencies) >= len(args_list)) and (time.perf_counter() - start > duration):
+			return latencies
+
+# Function to time calls of a function a few times, keeping the least disturbed run
+# Arguments:
+#	function, args_list, duration: see timeCalls
+#	repeat: number of runs
+# Return values:
+#	latencies: list of seconds taken by each call of the run with the lowest median latency
+def timeBest(function, args_list, duration, repeat=DEFAULT_REPEAT):
+	runs = [timeCalls(function, args_list, duration) for i in range(max(repeat, 1))]
+	return min(runs, key=lambda latencies: sorted(latencies)[len(latencies) // 2])
+
+# Function to measure the peak memory allocated while calling a function
+# Arguments:
+#	function: function to call
+#	args_list: list of argument tuples. The function is called once with each
+# Return values:
+#	peak: peak bytes allocated during the calls, on top of what was allocated before
+def measurePeak(function, args_list):
+	tracemalloc.start()
+	try:
+		base = tracemalloc.get_traced_memory()[0]
+		for args in args_list:
+			function(*args)
+		return tracemalloc.get_traced_memory()[1] - base
+	finally:
+		tracemalloc.stop()
+
+# Function to summarize latencies
+# Arguments:
+#	latencies: list of seconds taken by each call
+#	ops_per_call: number of operations each call does
+#	peak: peak bytes allocated, see measurePeak
+# Return values:
+#	result: dict of throughput in operations per second, p50 and p99 latency in seconds per call,
+#		and peak memory in bytes
+def summarize(latencies, ops_per_call, peak):
+	ordered = sorted(latencies)
+	return {
+		'ops_per_sec': ops_per_call*len(latencies) / max(sum(latencies), 1e-12),
+		'p50': ordered[len(ordered) // 2],
+		'p99': ordered[min(len(ordered) - 1, (len(ordered)*99) // 100)],
+		'peak_bytes': peak,
+		'calls': len(latencies)
+	}
+
+# Function to run the benchmarks on one database
+# Arguments:
+#	db_fname: name of database file
+#	benchmarks: names of benchmarks to run, see BENCHMARKS
+#	duration: seconds spent timing each run of each benchmark
+#	repeat: number of runs of each benchmark, see timeBest
+#	options: DecisionMaker keyword arguments
+# Return values:
+#	results: dict of result by benchmark name, see summarize
+def runBenchmarks(db_fname, benchmarks, duration=DEFAULT_DURATION, repeat=DEFAULT_REPEAT, **options):
+	results = {}
+	load = lambda: DecisionMaker(db_fname, **options)
+	if ('load' in benchmarks):
+		results['load'] = summarize(timeBest(load, [()], duration, repeat), 1, measurePeak(load, [()]))
+
+	# The queries are cycled through, so with the candidate cache every call after the first pass would
+	#	only time a cache hit. choose and chooseMany filter and score every call without it
+	decision_maker = DecisionMaker(db_fname, **dict(options, cache_bytes=0))
+	random.seed(0)
+	queries = makeQueries(decision_maker, NUM_QUERIES)
+	query_args = [(params,) for params in queries]
+
+	# Possibility methods, called on a sample of Possibility objects
+	possibilities = decision_maker.possibilities
+	rng = random.Random(0)
+	sample = [possibilities[rng.randrange(len(possibilities))] for i in range(len(queries))]
+	for name in ['inLimits', 'getProb']:
+		if (name in benchmarks):
+			args_list = [(getattr(possibility, name), params) for possibility, params in zip(sample, queries)]
+			call = lambda method, params: method(params)
+			results[name] = summarize(timeBest(call, args_list, duration, repeat), 1, measurePeak(call, args_list))
+
+	# Scoring of every Possibility, and choosing, including avoiding repeats
+	if ('getWeights' in benchmarks):
+		results['getWeights'] = summarize(timeBest(decision_maker.getWeights, query_args, duration, repeat), 1, \
+			measurePeak(decision_maker.getWeights, query_args))
+	if ('choose' in benchmarks):
+		results['choose'] = summarize(timeBest(decision_maker.choose, query_args, duration, repeat), 1, \
+			measurePeak(decision_maker.choose, query_args))
+
+	# Choosing from a warm cache, as when the same Parameters come up again
+	if ('chooseCached' in benchmarks):
+		cached_maker = load()
+		for params in queries:
+			cached_maker.prepare(params)
+		results['chooseCached'] = summarize(timeBest(cached_maker.choose, query_args, duration, repeat), 1, \
+			measurePeak(cached_maker.choose, query_args))
+		del cached_maker
+	if ('chooseMany' in benchmarks):
+		choose_many = lambda: list(decision_maker.chooseMany(queries))
+		results['chooseMany'] = summarize(timeBest(choose_many, [()], duration, repeat), len(queries), \
+			measurePeak(choose_many, [()]))
+	return results
+
+# Function to compare results against a baseline. p99 latency is too noisy to compare, and only reported
+# Arguments:
+#	results: dict of results by size and benchmark name, as returned by runBenchmarks
+#	baseline: results of an earlier run
+#	tolerance: relative slowdown or memory growth which counts as a regression
+# Return values:
+#	regressions: list of regression descriptions
+def compareResults(results, baseline, tolerance=DEFAULT_TOLERANCE):
+	regressions = []
+	for key, result in results.items():
+		if (key not in baseline):
+			continue
+		base = baseline[key]
+		checks = [
+			('p50', result['p50'], base['p50']),
+			('throughput', 1.0 / result['ops_per_sec'], 1.0 / base['ops_per_sec']),
+			('peak memory', result['peak_bytes'], base['peak_bytes'])
+		]
+		for name, value, base_value in checks:
+			if (value > base_value*(1 + tolerance)) and (value > 0):
+				regressions.append('{} {}: {:.1%} worse than baseline'.format(key, name, value / max(base_value, 1e-12) - 1))
+	return regressions
+
+# Function to print results as a table
+# Arguments:
+#	results: dict of results by size and benchmark name
+def printResults(results):
+	print('{:<24}{:>14}{:>12}{:>12}{:>12}'.format('benchmark', 'ops/s', 'p50 us', 'p99 us', 'peak MB'))
+	for key, result in results.items():
+		print('{:<24}{:>14.1f}{:>12.1f}{:>12.1f}{:>12.2f}'.format(key, result['ops_per_sec'], 1e6*result['p50'], \
+			1e6*result['p99'], result['peak_bytes'] / 1e6))
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Benchmark DecisionMaker on synthetic databases')
+	parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='numbers of rows')
+	parser.add_argument('--benchmarks', nargs='+', choices=BENCHMARKS, default=BENCHMARKS)
+	parser.add_argument('--backend', choices=BACKENDS, default=DEFAULT_BACKEND)
+	parser.add_argument('--duration', type=float, default=DEFAULT_DURATION, help='seconds per run of each benchmark')
+	parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='runs of each benchmark, the best is kept')
+	parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'DecisionBenchmark'), \
+		help='directory synthetic databases are kept in')
+	parser.add_argument('--save', default=None, help='save results to this file as a baseline')
+	parser.add_argument('--compare', default=None, help='compare results against this baseline file')
+	parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, \
+		help='relative slowdown over the baseline which fails the comparison')
+	args = parser.parse_args()
+
+	results = {}
+	for num_rows in args.sizes:
+		db_fname = getDatabase(args.data_dir, num_rows)
+		for name, result in runBenchmarks(db_fname, args.benchmarks, args.duration, args.repeat, \
+			backend=args.backend).items():
+			results['{}/{}/{}'.format(args.backend, num_rows, name)] = result
+		printResults({key: result for key, result in results.items() if (key.split('/')[1] == str(num_rows))})
+		sys.stdout.flush()
+
+	if (args.save is not None):
+		with open(args.save, 'w') as fptr:
+			json.dump(results, fptr, indent=1)
+
+	if (args.compare is not None):
+		with open(args.compare, 'r') as fptr:
+			regressions = compareResults(results, json.load(fptr), args.tolerance)
+		if (len(regressions) > 0):
+			print('\nREGRESSIONS against {}:'.format(args.compare))
+			for regression in regressions:
+				print('  ' + regression)
+			sys.exit(1)
+		print('\nNo regressions against {}'.format(args.compare))
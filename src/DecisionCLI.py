@@ -0,0 +1,137 @@
+#
+#    ___          _     _            __  ___     __          	 /\_______/\
+#   / _ \___ ____(_)__ (_)__  ___   /  |/  /__ _/ /_____ ____ 	 /_  ___   \
+#  / // / -_) __/ (_-</ / _ \/ _ \ / /|_/ / _ `/  '_/ -_) __/	/ @\/ @ \   \
+# /____/\__/\__/_/___/_/\___/_//_//_/  /_/\_,_/_/\_\\__/_/   	\__/\___/   /
+#																 \_\/______/
+#  DecisionCLI.py   											 /     /\\\\\ 
+#  Dylan Everingham for Marissa Kohan							|      \\\\\\\ 
+#																 \      \\\\\\\ 
+#																  \______/\\\\\
+#																	_||_||_
+
+
+#
+# Headless command line entry point for DecisionMaker app backend. Only loads DecisionMaker.py
+# Run with: python DecisionCLI.py [options] [PARAM ...]
+#	With parameters given as arguments, prints one decision. Otherwise reads one query per line from
+#	stdin, and prints one decision per line as they are made. A query is either one int per
+#	parameter in Parameter_Fields order, separated by spaces or commas, or field=value pairs
+
+# Dependencies
+import time
+start_time = time.perf_counter()
+import os
+import sys
+import argparse
+import itertools
+from DecisionMaker import *
+import_time = time.perf_counter()
+
+# Constants
+DEFAULT_DB_PATH = '../data/Possibilities.csv'
+
+# Seconds allowed from starting up to being ready for the first query. Slower startups are reported
+STARTUP_BUDGET = 0.5
+
+# Number of stdin queries scored together. Each batch is only answered once it is full, so by default
+#	every line is answered as soon as it arrives, e.g. for a co-process waiting on each decision
+DEFAULT_BATCH = 1
+
+# Function to read a Parameters from a query
+# Arguments:
+#	fields: list of strings, either one int per parameter or field=value pairs
+# Return values:
+#	params: Parameters. Raises ValueError if the query is malformed
+def parseQuery(fields):
+	if (len(fields) > 0) and all(('=' in field) for field in fields):
+		values = dict(field.split('=', 1) for field in fields)
+		unknown = [name for name in values if (name not in Parameter_Fields)]
+		if (len(unknown) > 0):
+			raise ValueError('Unknown parameters {}'.format(unknown))
+		missing = [name for name in Parameter_Fields if (name not in values)]
+		if (len(missing) > 0):
+			raise ValueError('Missing parameters {}'.format(missing))
+		fields = [values[name] for name in Parameter_Fields]
+	if (len(fields) != len(Parameter_Fields)):
+		raise ValueError('Expected {} parameters, got {}'.format(len(Parameter_Fields), len(fields)))
+	return Parameters(*[int(field) for field in fields])
+
+# Function to make decisions for lines of queries, batch by batch
+# Arguments:
+#	session: DecisionSession to make decisions in
+#	lines: iterable of query lines
+#	k: number of lines scored together
+#	output: file to write decisions to. Malformed lines get an empty line
+#	errors: file to write errors to
+# Return values:
+#	num_errors: number of malformed lines
+def decideLines(session, lines, k, output, errors):
+	num_errors = 0
+	line_numbers = itertools.count(1)
+	lines = iter(lines)
+	while True:
+		batch = list(itertools.islice(lines, k))
+		if (len(batch) == 0):
+			return num_errors
+
+		# Parse the batch, keeping the positions of malformed lines
+		params_batch = []
+		for line in batch:
+			line_number = next(line_numbers)
+			try:
+				params_batch.append(parseQuery(line.replace(',', ' ').split()))
+			except ValueError as error:
+				params_batch.append(None)
+				num_errors += 1
+				errors.write('line {}: {}\n'.format(line_number, error))
+
+		decisions = iter(session.chooseMany([params for params in params_batch if (params is not None)], k))
+		for params in params_batch:
+			output.write(('' if (params is None) else next(decisions)) + '\n')
+		output.flush()
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Make decisions from the command line')
+	parser.add_argument('params', nargs='*', help='one query. Reads queries from stdin if not given')
+	parser.add_argument('--db', default=DEFAULT_DB_PATH, help='database file')
+	parser.add_argument('--backend', choices=BACKENDS, default=DEFAULT_BACKEND)
+	parser.add_argument('--snapshot', action='store_true', help='keep and open a binary snapshot of the database')
+	parser.add_argument('--sampling', choices=SAMPLING_MODES, default='rejection')
+	parser.add_argument('--scoring', choices=SCORING_MODES, default='base')
+	parser.add_argument('--seed', default=None, help='seed, for repeatable decisions')
+	parser.add_argument('--batch', type=int, default=DEFAULT_BATCH, \
+		help='stdin queries scored together, for piped input that doesn\'t wait for each decision')
+	parser.add_argument('--budget', type=float, default=STARTUP_BUDGET, help='startup time budget in seconds')
+	parser.add_argument('--timings', action='store_true', help='print startup timings to stderr')
+	args = parser.parse_args()
+
+	decision_maker = DecisionMaker(args.db, backend=args.backend, snapshot=args.snapshot, \
+		sampling=args.sampling, scoring=args.scoring)
+	session = decision_maker.session(args.seed)
+	ready_time = time.perf_counter()
+
+	# Report the startup time, measured from the start of this script
+	startup = ready_time - start_time
+	if (args.timings):
+		sys.stderr.write('import {:.3f}s, load {:.3f}s, startup {:.3f}s (budget {:.3f}s)\n'.format( \
+			import_time - start_time, ready_time - import_time, startup, args.budget))
+	if (startup > args.budget):
+		sys.stderr.write('warning: startup took {:.3f}s, over budget of {:.3f}s\n'.format(startup, args.budget))
+	if (decision_maker.loadReport.num_rejected > 0):
+		sys.stderr.write(decision_maker.loadReport.getSummary() + '\n')
+
+	if (len(args.params) > 0):
+		try:
+			params = parseQuery(' '.join(args.params).replace(',', ' ').split())
+		except ValueError as error:
+			parser.error(str(error))
+		print(session.choose(params))
+	else:
+		try:
+			num_errors = decideLines(session, sys.stdin, max(args.batch, 1), sys.stdout, sys.stderr)
+		except BrokenPipeError:
+			# Output closed early, e.g. piped into head. Don't complain again when stdout is flushed at exit
+			os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+			sys.exit(1)
+		sys.exit(1 if (num_errors > 0) else 0)
@@ -0,0 +1,465 @@
+#
+#    ___          _     _            __  ___     __          	 /\_______/\
+#   / _ \___ ____(_)__ (_)__  ___   /  |/  /__ _/ /_____ ____ 	 /_  ___   \
+#  / // / -_) __/ (_-</ / _ \/ _ \ / /|_/ / _ `/  '_/ -_) __/	/ @\/ @ \   \
+# /____/\__/\__/_/___/_/\___/_//_//_/  /_/\_,_/_/\_\\__/_/   	\__/\___/   /
+#																 \_\/______/
+#  DecisionCoverage.py 											 /     /\\\\\ 
+#  Dylan Everingham for Marissa Kohan							|      \\\\\\\ 
+#																 \      \\\\\\\ 
+#																  \______/\\\\\
+#																	_||_||_
+
+
+#
+# Coverage analysis of a DecisionMaker database over the whole space of Parameters
+# Finds regions where no Possibility fits, so choose answers with EIGHT_BALL, regions where one
+#	message gets most of the weight, and how much of the space each message can be chosen in.
+# Weights only change where some row's limits start or end, so each parameter's range is cut into
+#	intervals at those breakpoints, and the space into cells which are products of intervals. With
+#	base scoring every point of a cell gets the same weights, so the full sweep evaluates one point
+#	per cell, and counts it as many times as the cell has points. Weighted scoring changes weights
+#	inside cells, so it needs a stratified sample of points instead
+# Run with: python DecisionCoverage.py [--db FILE] [--samples N] [--workers N]
+
+# Dependencies
+import os
+import time
+import argparse
+import concurrent.futures
+from DecisionMaker import *
+
+# Constants
+DEFAULT_DB_PATH = '../data/Possibilities.csv'
+
+# Share of the weight at a point one message needs for the point to count as dominated by it
+DEFAULT_DOMINANCE = 0.9
+
+# Number of values in the largest array made while evaluating a batch of points. Bounds memory use
+MAX_BATCH_ELEMENTS = 1 << 20
+
+# Number of chunks of work handed out per worker, so workers which finish early pick up more
+CHUNKS_PER_WORKER = 8
+
+# Default number of regions of each kind listed in a summary
+DEFAULT_MAX_REGIONS = 20
+
+# CoverageSweep of the table loaded by this worker process, see initWorker
+worker_sweep = None
+
+# Function to cut each parameter's range into intervals, where the limits of no row start or end
+#	inside an interval
+# Arguments:
+#	table: PossibilityTable
+#	ranges: (min, max) of each parameter
+# Return values:
+#	axes: list of (starts, lengths) int64 array pairs, one per parameter
+def getCellAxes(table, ranges=Parameter_Ranges):
+	n = table.size
+	axes = []
+	for f, (low, high) in enumerate(ranges):
+		starts = np.unique(np.concatenate([[low], table.min_limits[:n, f].astype(np.int64), \
+			table.max_limits[:n, f].astype(np.int64) + 1]))
+		starts = starts[(starts >= low) & (starts <= high)]
+		axes.append((starts, np.diff(np.append(starts, high + 1))))
+	return axes
+
+# Function to merge cells into larger boxes of cells. Runs of neighbouring cells along one
+#	parameter are merged, one parameter at a time, so the boxes aren't always the fewest possible
+# Arguments:
+#	cells: int array of flat cell numbers
+#	shape: number of intervals of each parameter
+# Return values:
+#	lows, highs: (K, len(shape)) int arrays of the first and last interval of each box
+def mergeCells(cells, shape):
+	coords = np.stack(np.unravel_index(np.unique(cells), shape), axis=1)
+	lows, highs = coords, coords.copy()
+	for f in reversed(range(len(shape))):
+		if (len(lows) <= 1):
+			break
+		others = [g for g in range(len(shape)) if (g != f)]
+
+		# Sort boxes with the same intervals of the other parameters next to each other, along f
+		order = np.lexsort([lows[:, f]] + [highs[:, g] for g in others] + [lows[:, g] for g in others])
+		lows, highs = lows[order], highs[order]
+		joined = np.all(lows[1:, others] == lows[:-1, others], axis=1) & \
+			np.all(highs[1:, others] == highs[:-1, others], axis=1) & (lows[1:, f] == highs[:-1, f] + 1)
+		starts = np.flatnonzero(np.concatenate([[True], ~joined]))
+		ends = np.append(starts[1:], len(lows)) - 1
+		lows, highs = lows[starts], highs[ends]
+	return lows, highs
+
+# CoverageReport object
+# Volumes of the space evaluated so far, where no Possibility fits and where each message can be
+#	chosen, and the cells of empty and dominated points. Reports of parts of the space can be merged
+class CoverageReport:
+
+	# CoverageReport class constructor
+	# Arguments:
+	#	num_messages: number of messages in the table
+	def __init__(self, num_messages):
+		self.num_evaluated = 0
+		self.volume = 0.0
+		self.empty_volume = 0.0
+
+		# Per message: volume where its weight isn't 0, volume times its probability, and its
+		#	highest probability at any point
+		self.reach_volume = np.zeros(num_messages)
+		self.prob_volume = np.zeros(num_messages)
+		self.max_prob = np.zeros(num_messages)
+
+		# Cells holding empty points, and cells holding dominated points with their dominant message
+		self.empty_cells = np.zeros(0, dtype=np.int64)
+		self.dominated_cells = np.zeros(0, dtype=np.int64)
+		self.dominated_messages = np.zeros(0, dtype=np.int64)
+
+	# Function to record a batch of evaluated points
+	# Arguments:
+	#	cells: int array of the cell of each point
+	#	volumes: number of points of the space each point stands for
+	#	weights: (len(cells), num_messages) array of the summed weights of each message at each point
+	#	dominance: share of the weight one message needs for a point to be dominated by it
+	def add(self, cells, volumes, weights, dominance=DEFAULT_DOMINANCE):
+		totals = weights.sum(axis=1)
+		empty = (totals <= 0)
+		probs = weights / np.where(empty, 1, totals)[:, None]
+		self.num_evaluated += len(cells)
+		self.volume += volumes.sum()
+		self.empty_volume += volumes[empty].sum()
+		self.reach_volume += volumes @ (weights > 0)
+		self.prob_volume += volumes @ probs
+		if (len(cells) > 0):
+			self.max_prob = np.maximum(self.max_prob, probs.max(axis=0))
+		self.empty_cells = np.concatenate([self.empty_cells, cells[empty]])
+
+		top = probs.argmax(axis=1)
+		dominated = ~empty & (probs[np.arange(len(cells)), top] >= dominance)
+		self.dominated_cells = np.concatenate([self.dominated_cells, cells[dominated]])
+		self.dominated_messages = np.concatenate([self.dominated_messages, top[dominated]])
+
+	# Function to add the volumes and cells of another report to this one
+	# Arguments:
+	#	report: CoverageReport to add
+	def merge(self, report):
+		self.num_evaluated += report.num_evaluated
+		self.volume += report.volume
+		self.empty_volume += report.empty_volume
+		self.reach_volume += report.reach_volume
+		self.prob_volume += report.prob_volume
+		self.max_prob = np.maximum(self.max_prob, report.max_prob)
+		self.empty_cells = np.concatenate([self.empty_cells, report.empty_cells])
+		self.dominated_cells = np.concatenate([self.dominated_cells, report.dominated_cells])
+		self.dominated_messages = np.concatenate([self.dominated_messages, report.dominated_messages])
+
+# CoverageSweep object
+# Evaluates the weight of every message at batches of points of the space of Parameters
+class CoverageSweep:
+
+	# CoverageSweep class constructor
+	# Arguments:
+	#	table: PossibilityTable to analyse
+	#	scoring: one of SCORING_MODES
+	#	ranges: (min, max) of each parameter
+	def __init__(self, table, scoring='base', ranges=Parameter_Ranges):
+		if (scoring not in SCORING_MODES):
+			raise ValueError('Unknown scoring mode {}, must be one of {}'.format(scoring, SCORING_MODES))
+		self.table = table
+		self.scoring = scoring
+		self.ranges = ranges
+		n = table.size
+		self.num_messages = len(table.messages)
+
+		# Cells of the space
+		self.axes = getCellAxes(table, ranges)
+		self.shape = tuple(len(starts) for starts, lengths in self.axes)
+		self.num_cells = int(np.prod(self.shape, dtype=np.int64))
+		self.sizes = tuple(high - low + 1 for low, high in ranges)
+		self.num_points = int(np.prod(self.sizes, dtype=np.int64))
+
+		# Rows with identical limits are checked once, as a group
+		order, starts = groupLimits(table.min_limits[:n], table.max_limits[:n])
+		self.box_mins = table.min_limits[:n][order[starts[:-1]]]
+		self.box_maxs = table.max_limits[:n][order[starts[:-1]]]
+		self.row_groups = np.zeros(n, dtype=np.int64)
+		self.row_groups[order] = np.repeat(np.arange(len(starts) - 1), np.diff(starts))
+
+		# With base scoring each group's weight per message never changes
+		self.group_weights = np.zeros((len(starts) - 1, self.num_messages))
+		np.add.at(self.group_weights, (self.row_groups, table.message_ids[:n]), table.base_weights[:n])
+
+		# With weighted scoring rows are scored one by one, and summed per message. Rows are sorted
+		#	by message, and only messages with rows are summed
+		self.message_order = np.argsort(table.message_ids[:n], kind='stable')
+		message_starts = np.searchsorted(table.message_ids[:n][self.message_order], np.arange(self.num_messages))
+		self.message_present = (np.diff(np.append(message_starts, n)) > 0)
+		self.message_starts = message_starts[self.message_present]
+
+		# Points per batch, so the largest array stays within MAX_BATCH_ELEMENTS values.
+		#	The same for every worker, so sampled points don't depend on how work is split up
+		width = max(len(self.box_mins), self.num_messages, n if (scoring == 'weighted') else 1, 1)
+		self.batch_size = max(1, MAX_BATCH_ELEMENTS // width)
+
+	# Function to get the summed weight of each message at some points
+	# Arguments:
+	#	points: (B, len(Parameter_Fields)) int array
+	# Return values:
+	#	weights: (B, num_messages) float array
+	def getMessageWeights(self, points):
+		fits = np.ones((len(points), len(self.box_mins)), dtype=bool)
+		for f in range(len(Parameter_Fields)):
+			fits &= (self.box_mins[:, f] <= points[:, f, None])
+			fits &= (points[:, f, None] <= self.box_maxs[:, f])
+		if (self.scoring == 'base'):
+			return fits @ self.group_weights
+
+		n = self.table.size
+		row_weights = self.table.base_weights[:n] + points @ self.table.param_weights[:n].T.astype(np.int64)
+		row_weights = np.where(fits[:, self.row_groups], np.maximum(row_weights, 0), 0)
+		weights = np.zeros((len(points), self.num_messages))
+		if (len(self.message_starts) > 0):
+			weights[:, self.message_present] = np.add.reduceat(row_weights[:, self.message_order], \
+				self.message_starts, axis=1)
+		return weights
+
+	# Function to get the cells of some points
+	# Arguments:
+	#	points: (B, len(Parameter_Fields)) int array
+	# Return values:
+	#	cells: int array of flat cell numbers
+	def getCells(self, points):
+		coords = [np.searchsorted(starts, points[:, f], 'right') - 1 for f, (starts, lengths) in enumerate(self.axes)]
+		return np.ravel_multi_index(coords, self.shape)
+
+	# Function to get the first point of some cells, and how many points they have
+	# Arguments:
+	#	cells: int array of flat cell numbers
+	# Return values:
+	#	points: (B, len(Parameter_Fields)) int array
+	#	volumes: float array of the number of points of each cell
+	def getCellPoints(self, cells):
+		coords = np.unravel_index(cells, self.shape)
+		points = np.stack([self.axes[f][0][c] for f, c in enumerate(coords)], axis=1)
+		volumes = np.prod([self.axes[f][1][c] for f, c in enumerate(coords)], axis=0).astype(np.float64)
+		return points, volumes
+
+	# Function to draw points of a stratified sample. The space is ordered like the flat cell
+	#	numbers and cut into num_samples strata of equal size, and sample i is a random point of stratum i
+	# Arguments:
+	#	samples: int array of sample numbers
+	#	num_samples: size of the whole sample
+	#	rng: numpy random Generator
+	# Return values:
+	#	points: (B, len(Parameter_Fields)) int array
+	def getSamplePoints(self, samples, num_samples, rng):
+		# Stratum bounds, as samples*num_points // num_samples without overflowing
+		step, rest = divmod(self.num_points, num_samples)
+		lows = samples*step + (samples*rest) // num_samples
+		highs = (samples + 1)*step + ((samples + 1)*rest) // num_samples
+		flat = lows + (rng.random(len(samples))*(highs - lows)).astype(np.int64)
+		coords = np.unravel_index(flat, self.sizes)
+		return np.stack([c + low for c, (low, high) in zip(coords, self.ranges)], axis=1)
+
+	# Function to evaluate part of the space
+	# Arguments:
+	#	start, stop: range of cells to evaluate, or of sample numbers if num_samples isn't None
+	#	num_samples: size of a stratified sample to take instead of evaluating every cell
+	#	seed: random seed of the sample. Each batch is seeded from this and its first sample number
+	#	dominance: see CoverageReport.add
+	# Return values:
+	#	report: CoverageReport of the evaluated points
+	def sweep(self, start, stop, num_samples=None, seed=0, dominance=DEFAULT_DOMINANCE):
+		report = CoverageReport(self.num_messages)
+		for batch_start in range(start, stop, self.batch_size):
+			numbers = np.arange(batch_start, min(batch_start + self.batch_size, stop), dtype=np.int64)
+			if (num_samples is None):
+				cells = numbers
+				points, volumes = self.getCellPoints(cells)
+			else:
+				points = self.getSamplePoints(numbers, num_samples, np.random.default_rng([seed, batch_start]))
+				cells = self.getCells(points)
+				volumes = np.full(len(numbers), self.num_points / num_samples)
+			report.add(cells, volumes, self.getMessageWeights(points), dominance)
+		return report
+
+	# Function to get the parameter values and number of points of boxes of cells
+	# Arguments:
+	#	lows, highs: see mergeCells
+	# Return values:
+	#	boxes: list of Parameters of (min, max) values
+	#	volumes: float array of the number of points of each box
+	def getBoxes(self, lows, highs):
+		boxes = []
+		volumes = np.ones(len(lows))
+		for f, (starts, lengths) in enumerate(self.axes):
+			ends = np.concatenate([[0], np.cumsum(lengths)])
+			volumes *= ends[highs[:, f] + 1] - ends[lows[:, f]]
+		for low, high in zip(lows, highs):
+			boxes.append(Parameters(*[(int(starts[l]), int(starts[h] + lengths[h] - 1)) \
+				for (starts, lengths), l, h in zip(self.axes, low, high)]))
+		return boxes, volumes
+
+	# Function to describe a box, leaving out parameters which span their whole range
+	# Arguments:
+	#	box: Parameters of (min, max) values
+	# Return values:
+	#	description: string
+	def describeBox(self, box):
+		parts = ['{}={}..{}'.format(field, low, high) if (low != high) else '{}={}'.format(field, low) \
+			for field, (low, high), full in zip(Parameter_Fields, box, self.ranges) if ((low, high) != tuple(full))]
+		return ' '.join(parts) if (len(parts) > 0) else 'everywhere'
+
+# Function to set up a worker process, see runCoverage
+# Arguments:
+#	buffer: database snapshot, see packSnapshot
+#	scoring, ranges: see CoverageSweep
+def initWorker(buffer, scoring, ranges):
+	global worker_sweep
+	table = PossibilityTable(capacity=0)
+	table.loadBuffer(buffer)
+	worker_sweep = CoverageSweep(table, scoring, ranges)
+
+# Function to evaluate part of the space in a worker process
+# Arguments:
+#	see CoverageSweep.sweep
+# Return values:
+#	report: CoverageReport
+def sweepChunk(start, stop, num_samples, seed, dominance):
+	return worker_sweep.sweep(start, stop, num_samples, seed, dominance)
+
+# Function to analyse the coverage of a database
+# Arguments:
+#	db_fname: name of database file, or list of shard files
+#	num_samples: size of a stratified sample of points to evaluate. None evaluates every cell,
+#		which needs base scoring
+#	num_workers: number of worker processes. Defaults to the number of CPUs
+#	seed: random seed of the sample
+#	scoring: one of SCORING_MODES
+#	dominance: see CoverageReport.add
+#	ranges: (min, max) of each parameter
+# Return values:
+#	sweep: CoverageSweep of the loaded table
+#	report: CoverageReport of the whole space
+#	timings: dict of seconds spent loading and sweeping
+def runCoverage(db_fname, num_samples=None, num_workers=None, seed=0, scoring='base', \
+	dominance=DEFAULT_DOMINANCE, ranges=Parameter_Ranges):
+	if (num_samples is None) and (scoring != 'base'):
+		raise ValueError('Weights change inside cells with {} scoring, sample the space instead'.format(scoring))
+	if (num_samples is not None) and (num_samples < 1):
+		raise ValueError('Number of samples must be at least 1, got {}'.format(num_samples))
+	if (num_workers is None):
+		num_workers = os.cpu_count() or 1
+	if (num_workers < 1):
+		raise ValueError('Number of workers must be at least 1, got {}'.format(num_workers))
+
+	start = time.perf_counter()
+	database = PossibilityDatabase(db_fname, backend='numpy', cache_bytes=0, scoring=scoring)
+	sweep = CoverageSweep(database.table, scoring, ranges)
+	timings = {'load': time.perf_counter() - start}
+
+	# Hand out chunks of whole batches, so sampled batches get the same seeds however work is split up
+	start = time.perf_counter()
+	total = sweep.num_cells if (num_samples is None) else num_samples
+	chunk_size = -(-total // (num_workers*CHUNKS_PER_WORKER))
+	chunk_size = -(-chunk_size // sweep.batch_size)*sweep.batch_size
+	chunks = [(chunk_start, min(chunk_start + chunk_size, total)) for chunk_start in range(0, total, chunk_size)]
+	report = CoverageReport(sweep.num_messages)
+	if (num_workers == 1):
+		for chunk_start, chunk_stop in chunks:
+			report.merge(sweep.sweep(chunk_start, chunk_stop, num_samples, seed, dominance))
+	else:
+		# Workers load the table from a snapshot instead of parsing the database again
+		size, sections = packSnapshot(database.table)
+		buffer = bytearray(size)
+		for offset, data in sections:
+			buffer[offset:offset + len(data)] = data
+		with concurrent.futures.ProcessPoolExecutor(num_workers, initializer=initWorker, \
+			initargs=(bytes(buffer), scoring, ranges)) as pool:
+			futures = [pool.submit(sweepChunk, chunk_start, chunk_stop, num_samples, seed, dominance) \
+				for chunk_start, chunk_stop in chunks]
+			for future in futures:
+				report.merge(future.result())
+	timings['sweep'] = time.perf_counter() - start
+	return sweep, report, timings
+
+# Function to describe a coverage report
+# Arguments:
+#	sweep, report, timings: see runCoverage
+#	num_samples: size of the sample, or None for a full sweep
+#	num_workers: number of worker processes used
+#	max_regions: maximum number of regions of each kind listed
+#	dominance: see CoverageReport.add
+# Return values:
+#	summary: multi line string
+def getCoverageSummary(sweep, report, timings, num_samples=None, num_workers=1, max_regions=DEFAULT_MAX_REGIONS, \
+	dominance=DEFAULT_DOMINANCE):
+	table = sweep.table
+	volume = max(report.volume, 1)
+	if (num_samples is None):
+		method = 'Full sweep of {} points in {} cells'.format(sweep.num_points, sweep.num_cells)
+	else:
+		method = 'Stratified sample of {} of {} points ({:.2g}%) over {} cells'.format(num_samples, \
+			sweep.num_points, 100*num_samples / sweep.num_points, sweep.num_cells)
+	lines = ['{} rows, {} messages, {} scoring'.format(table.size, sweep.num_messages, sweep.scoring)]
+	lines.append('{}, {} workers: loaded in {:.2f} s, swept in {:.2f} s ({:.3g} {} evaluated per second)'.format( \
+		method, num_workers, timings['load'], timings['sweep'], report.num_evaluated / max(timings['sweep'], 1e-9), \
+		'cells' if (num_samples is None) else 'points'))
+	lines.append('Covered: {:.4f}% of the space. EIGHT_BALL is answered in {:.4f}% ({:.0f} points)'.format( \
+		100*(1 - report.empty_volume / volume), 100*report.empty_volume / volume, report.empty_volume))
+
+	# Empty regions, largest first
+	cell_kind = 'cells' if (num_samples is None) else 'cells with sampled points'
+	boxes, volumes = sweep.getBoxes(*mergeCells(report.empty_cells, sweep.shape))
+	lines.append('\nEmpty regions ({}): {}'.format(cell_kind, len(boxes)))
+	for i in np.argsort(-volumes, kind='stable')[:max_regions]:
+		lines.append('  {:>9.4f}%  {}'.format(100*volumes[i] / sweep.num_points, sweep.describeBox(boxes[i])))
+	if (len(boxes) > max_regions):
+		lines.append('  ... {} more empty regions'.format(len(boxes) - max_regions))
+
+	# Dominated regions of each message, largest first
+	regions = []
+	for message in np.unique(report.dominated_messages):
+		boxes, volumes = sweep.getBoxes(*mergeCells(report.dominated_cells[report.dominated_messages == message], \
+			sweep.shape))
+		regions += [(volume, box, message) for volume, box in zip(volumes, boxes)]
+	regions.sort(key=lambda region: -region[0])
+	lines.append('\nRegions dominated by one message (at least {:.0f}% of the weight, {}): {}'.format( \
+		100*dominance, cell_kind, len(regions)))
+	for volume, box, message in regions[:max_regions]:
+		lines.append('  {:>9.4f}%  {}: {!r}'.format(100*volume / sweep.num_points, sweep.describeBox(box), \
+			table.messages[message]))
+	if (len(regions) > max_regions):
+		lines.append('  ... {} more dominated regions'.format(len(regions) - max_regions))
+
+	# Reachability of each message, least reachable first
+	lines.append('\nReachability per message: % of space where it can be chosen, mean and max probability')
+	order = np.lexsort([-report.prob_volume, report.reach_volume])
+	for message in order:
+		lines.append('  {:>9.4f}% {:>9.4f}% {:>9.4f}%  {!r}'.format(100*report.reach_volume[message] / volume, \
+			100*report.prob_volume[message] / volume, 100*report.max_prob[message], table.messages[message]))
+	unreachable = np.flatnonzero(report.reach_volume == 0)
+	lines.append('{} of {} messages can never be chosen'.format(len(unreachable), sweep.num_messages))
+	return '\n'.join(lines)
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Find where a DecisionMaker database leaves no possibility, ' \
+		'or only one message, over the whole space of parameters')
+	parser.add_argument('--db', default=DEFAULT_DB_PATH, help='database file')
+	parser.add_argument('--samples', type=int, default=None, \
+		help='evaluate a stratified sample of this many points instead of every cell')
+	parser.add_argument('--workers', type=int, default=None, help='worker processes, defaults to the number of CPUs')
+	parser.add_argument('--seed', type=int, default=0, help='random seed of the sample')
+	parser.add_argument('--scoring', choices=SCORING_MODES, default='base', \
+		help='weighted scoring needs --samples')
+	parser.add_argument('--dominance', type=float, default=DEFAULT_DOMINANCE, \
+		help='share of the weight one message needs to dominate a point')
+	parser.add_argument('--max-regions', type=int, default=DEFAULT_MAX_REGIONS, help='regions of each kind listed')
+	args = parser.parse_args()
+
+	num_workers = args.workers if (args.workers is not None) else (os.cpu_count() or 1)
+	try:
+		sweep, report, timings = runCoverage(args.db, args.samples, num_workers, args.seed, args.scoring, \
+			args.dominance)
+	except ValueError as error:
+		parser.error(str(error))
+	print('Coverage of {}'.format(args.db))
+	print(getCoverageSummary(sweep, report, timings, args.samples, num_workers, args.max_regions, args.dominance))
@@ -17,11 +17,108 @@
 # Dependencies
 import random
 import collections
+import collections.abc
 import csv
+import itertools
+import bisect
+import hashlib
+import weakref
+import sys
+import os
+import mmap
+import struct
+import concurrent.futures
+import threading
+import time
+import zipfile
+import xml.etree.ElementTree as ElementTree
+
+# NumPy is optional, and only required for the columnar backend
+try:
+	import numpy as np
+except ImportError:
+	np = None
 
 # Constants
 EIGHT_BALL = ['Reply hazy try again', 'Ask again later', 'Better not tell you now', 'Cannot predict now', 'Concentrate and ask again']
 
+# Default memory bound of the DecisionMaker candidate cache, in bytes
+DEFAULT_CACHE_BYTES = 16*1024*1024
+
+# Number of candidate cache hits queued before the hit path takes the lock to apply them
+MAX_CACHE_TOUCHED = 1024
+
+# Sampling modes used by DecisionMaker to avoid repeating the last decision
+#	rejection: draw, and draw again while the last decision comes up
+#	exclude: leave out Possibilities with the last decision's message, then draw exactly once.
+#		Same distribution as rejection, but different random numbers are consumed
+SAMPLING_MODES = ['rejection', 'exclude']
+
+# Scoring modes used to weight Possibilities whose limits fit some Parameters
+#	base: the base weight only
+#	weighted: the base weight plus the dot product of the Parameters and the parameter weights,
+#		clamped so it's never negative
+SCORING_MODES = ['base', 'weighted']
+
+# Samplers used by Candidates to make a weighted random choice
+#	prefix: bisect the cumulative weights, O(log N) per draw. Same choices as random.choices
+#	alias: Walker alias table, O(1) per draw after an O(N) build. Consumes different random numbers
+SAMPLERS = ['prefix', 'alias']
+
+# Number of database rows parsed and appended to storage at a time
+LOAD_CHUNK_SIZE = 4096
+
+# Maximum number of per-value masks a FeasibilityTracker keeps for each parameter
+MAX_TRACKED_MASKS = 16
+
+# Maximum number of (Parameters, message) weight sums made at once by getDistributionMany. Bounds memory use
+MAX_DISTRIBUTION_SUMS = 1 << 22
+
+# Maximum number of named sessions whose last decisions are kept by chooseMany. The least recently used
+#	ones are forgotten first. Long lived sessions should use DecisionSession objects instead
+MAX_SESSION_DECISIONS = 10000
+
+# Maximum number of rejected database lines whose reasons are kept in a LoadReport
+MAX_REPORTED_REJECTS = 1000
+
+# Upper bounds of Metrics histogram buckets, for durations in seconds and for counts
+TIMING_BUCKETS = [1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, \
+	1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+COUNT_BUCKETS = [0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 100000, 1000000]
+
+# Metrics recorded by DecisionMaker: name, type, histogram buckets and description
+METRICS = [
+	('decisions_total', 'counter', None, 'Decisions made'),
+	('eight_ball_total', 'counter', None, 'Decisions answered with EIGHT_BALL because all weights were 0'),
+	('retries_total', 'counter', None, 'Extra draws made to avoid repeating the last decision'),
+	('filter_seconds', 'histogram', TIMING_BUCKETS, 'Time finding the rows which fit some Parameters'),
+	('batch_filter_seconds', 'histogram', TIMING_BUCKETS, 'Time finding the rows which fit a batch of Parameters'),
+	('weights_seconds', 'histogram', TIMING_BUCKETS, 'Time scoring the rows which fit some Parameters'),
+	('sample_seconds', 'histogram', TIMING_BUCKETS, 'Time drawing a decision from scored candidates'),
+	('candidates', 'histogram', COUNT_BUCKETS, 'Candidates with nonzero weight per decision'),
+	('retries', 'histogram', COUNT_BUCKETS, 'Extra draws per decision to avoid repeating the last decision'),
+	('reload_seconds', 'histogram', TIMING_BUCKETS, 'Time loading the database again')
+]
+
+# OpenDocument spreadsheet database files. Possibilities are read from the first sheet in the
+#	content file of the zip, using the namespaces of its XML elements and attributes
+ODS_EXT = '.ods'
+ODS_CONTENT = 'content.xml'
+ODS_TABLE = '{urn:oasis:names:tc:opendocument:xmlns:table:1.0}'
+ODS_OFFICE = '{urn:oasis:names:tc:opendocument:xmlns:office:1.0}'
+ODS_TEXT = '{urn:oasis:names:tc:opendocument:xmlns:text:1.0}'
+
+# Binary snapshot files of a PossibilityTable. See packSnapshot for the layout
+SNAPSHOT_EXT = '.dmsnap'
+SNAPSHOT_MAGIC = b'DMSNAP\x00\x01'
+SNAPSHOT_HEADER = struct.Struct('<8sIIQQQQq32s')
+
+# Backends used by DecisionMaker to score Possibilities
+#	python: one Possibility object per row, scored one at a time with getProb
+#	numpy: all rows stored in a columnar PossibilityTable, scored with vectorized ops
+BACKENDS = ['python', 'numpy']
+DEFAULT_BACKEND = 'numpy' if (np is not None) else 'python'
+
 # Parameters [Range] (Encoding) :
 #
 # Date
@@ -57,38 +154,55 @@ Parameters = collections.namedtuple(
 	Parameter_Fields
 )
 
+# (min, max) of each input parameter, see the ranges above
+Parameter_Ranges = Parameters(
+	day=(0, 6),
+	year=(-100, 100),
+	time=(0, 23),
+	weather=(0, 4),
+	alone=(0, 1),
+	hunger=(-5, 5),
+	thirst=(-5, 5),
+	energy=(-5, 5),
+	introversion=(-5, 5),
+	stress=(-5, 5),
+	retograde=(0, 1)
+)
+
 # Possibility object
 # Has a min/max for each parameter, weighting for each parameter, a baseline weight, and a message string
 # All fields must be ints, except for message
 class Possibility:
+	__slots__ = ['param_limits', 'param_weights', 'base_weight', 'message']
 
 	# Possibility class constructor
 	# Arguments:
 	#	min_params: tuple containing minimum parameter values under which this possibility can be selected
 	#	max_params: tuple containing maximum parameter values under which this possibility can be selected
 	#	param_weights: tuple containing probability weight scale factors for each input parameter
-	#	base_weight: base probability weight. should be a float in range [0 1]
+	#	base_weight: base probability weight. must be an int, as read from the database file
 	#	message: string displayed when this Possibility is chosen
 	def __init__(self, min_params, max_params, param_weights, base_weight, message):
 		# Save all parameter limits
-		self.param_limits = Parameters(*tuple([[min_params[i], max_params[i]] for i in range(len(Parameter_Fields))]))
+		self.param_limits = Parameters(*tuple([(min_params[i], max_params[i]) for i in range(len(Parameter_Fields))]))
 
 		# Save all parameter weights
 		self.param_weights = param_weights
 		self.base_weight = base_weight
 
-		# Save message
-		self.message = message
+		# Save message. Possibilities often share messages, so keep only one copy of each
+		self.message = sys.intern(message)
 
 	# Function to return probability weight of this possibility being chosen under some Parameters.
 	# If the Parameters are outside this Possibility's limits, return 0.
 	# Arguments:
 	#	params: Parameters under which we want to calculate the weighted probability of this Possibility
 	#			being chosen
+	#	scoring: one of SCORING_MODES
 	# Return values:
 	#	prob: probability of this Possibility being chosen. Can be any non-negative float. Percent probability
 	#			is calculated by dividing this by the sum of all other Possibility's weights
-	def getProb(self, params):
+	def getProb(self, params, scoring='base'):
 		# Make sure the parameters fit first
 		if not (self.inLimits(params)):
 			return 0
@@ -97,10 +211,13 @@ class Possibility:
 		prob = 0
 
 		# Sum up parameter weights
-		#prob = sum([[params.f * self.param_weights.f] for f in Parameter_Fields])
+		if (scoring == 'weighted'):
+			prob = sum([params[i] * self.param_weights[i] for i in range(len(Parameter_Fields))])
 
 		# Add base weight
 		prob += self.base_weight
+		if (scoring == 'weighted'):
+			prob = max(prob, 0)
 		return prob
 	
 	# Function which determines if some Parameters fall within this Possibility's limits
@@ -124,56 +241,2021 @@ class Possibility:
 	def getMsg(self):
 		return self.message
 
-# DecisionMaker object
-# Has a list of possibility objects
-class DecisionMaker:
-	# DecisionMaker class constructor
+# MessageTable object
+# String table of unique messages. Messages can be stored utf-8 encoded back to back in a blob,
+#	as in a snapshot, and are then only decoded when accessed. Messages added later are kept
+#	as strings.
+class MessageTable(collections.abc.Sequence):
+
+	# MessageTable class constructor
+	# Arguments:
+	#	blob: buffer holding encoded messages
+	#	offsets: int array of len(messages) + 1 offsets into blob where each message starts
+	def __init__(self, blob=b'', offsets=None):
+		self.blob = blob
+		self.offsets = offsets
+		self.num_stored = 0 if (offsets is None) else len(offsets) - 1
+		self.added = []
+
+		# Message number of each message, built when first needed
+		self.numbers = None
+
+	def __len__(self):
+		return self.num_stored + len(self.added)
+
+	def __getitem__(self, i):
+		if (i < self.num_stored):
+			return str(self.blob[self.offsets[i]:self.offsets[i + 1]], 'utf-8')
+		return self.added[i - self.num_stored]
+
+	# Function to find the number of a message
+	# Arguments:
+	#	message: message string
+	# Return values:
+	#	number: index of the message, or None if it isn't in the table
+	def find(self, message):
+		if (self.numbers is None):
+			self.numbers = {m: i for i, m in enumerate(self)}
+		return self.numbers.get(message)
+
+	# Function to get the number of a message, adding it if it's new
+	# Arguments:
+	#	message: message string
+	# Return values:
+	#	number: index of the message
+	def add(self, message):
+		number = self.find(message)
+		if (number is None):
+			number = len(self)
+			self.added.append(message)
+			self.numbers[message] = number
+		return number
+
+	# Function to encode all messages back to back
+	# Arguments:
+	#	None
+	# Return values:
+	#	blob: bytes holding all encoded messages
+	#	offsets: uint64 array of len(self) + 1 offsets into blob where each message starts
+	def encode(self):
+		encoded = [m.encode('utf-8') for m in self]
+		offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+		np.cumsum([len(m) for m in encoded], out=offsets[1:])
+		return b''.join(encoded), offsets
+
+# Function to convert Parameters to an array to compare with table limits and weights. Limits are int8,
+#	so values are clipped to just outside that range: values beyond it fit no row either way, and
+#	can't overflow the cast. Values which aren't whole numbers are kept as floats instead of truncated
+# Arguments:
+#	params: Parameters, or a sequence of Parameters
+# Return values:
+#	p: int32 array, or float64 array if any value isn't a whole number, of the same shape as params
+def getParamsArray(params):
+	p = np.clip(np.asarray(params, dtype=np.float64), -129, 128)
+	if np.all(p == np.floor(p)):
+		return p.astype(np.int32)
+	return p
+
+# PossibilityTable object
+# Compact columnar storage for a list of Possibilities, used by the numpy backend.
+# Limits and weights of all rows are kept in contiguous (N, len(Parameter_Fields)) int8 arrays,
+# so a whole table can be scored under some Parameters with a few vectorized ops.
+# Messages are kept once each in a string table, and rows refer to them by number.
+class PossibilityTable:
+
+	# PossibilityTable class constructor
+	# Arguments:
+	#	capacity: number of rows to allocate space for up front. Grows as needed
+	def __init__(self, capacity=256):
+		if (np is None):
+			raise ImportError('PossibilityTable requires numpy')
+
+		# Number of rows in use
+		self.size = 0
+
+		# Per parameter limits and weights, one row per Possibility
+		n_fields = len(Parameter_Fields)
+		self.min_limits = np.zeros((capacity, n_fields), dtype=np.int8)
+		self.max_limits = np.zeros((capacity, n_fields), dtype=np.int8)
+		self.param_weights = np.zeros((capacity, n_fields), dtype=np.int8)
+		self.base_weights = np.zeros(capacity, dtype=np.int32)
+
+		# String table of unique messages, and the message number of each row
+		self.messages = MessageTable()
+		self.message_ids = np.zeros(capacity, dtype=np.int32)
+
+		# Buffer the arrays are stored in when opened from a snapshot. See loadBuffer
+		self.buffer = None
+
+		# Rows of each message, built when first needed. See getMsgRows
+		self.message_rows = None
+
+	# Function to append a Possibility to the end of the table
+	# Arguments:
+	#	possibility: Possibility to copy limits, weights and message from
+	def addPossibility(self, possibility):
+		self.addRow(
+			[l[0] for l in possibility.param_limits],
+			[l[1] for l in possibility.param_limits],
+			possibility.param_weights,
+			possibility.base_weight,
+			possibility.getMsg()
+		)
+
+	# Function to append a row to the end of the table
+	# Arguments:
+	#	min_params: sequence of minimum parameter values
+	#	max_params: sequence of maximum parameter values
+	#	param_weights: sequence of parameter weights
+	#	base_weight: base probability weight
+	#	message: message string
+	def addRow(self, min_params, max_params, param_weights, base_weight, message):
+		# Double capacity when full
+		if (self.size == len(self.base_weights)):
+			self.resize(max(2*self.size, 1))
+
+		# Limits and weights must fit in int8, base weights in int32
+		values = list(min_params) + list(max_params) + list(param_weights)
+		if (min(values) < -128) or (max(values) > 127):
+			raise ValueError('Limits and weights of \'{}\' must be in range [-128 127]'.format(message))
+		if (base_weight != int(base_weight)) or (base_weight < -2**31) or (base_weight >= 2**31):
+			raise ValueError('Base weight of \'{}\' must be an int in range [-2^31 2^31)'.format(message))
+
+		i = self.size
+		self.min_limits[i] = min_params
+		self.max_limits[i] = max_params
+		self.param_weights[i] = param_weights
+		self.base_weights[i] = base_weight
+		self.message_ids[i] = self.messages.add(message)
+		self.message_rows = None
+		self.size += 1
+
+	# Function to append many rows to the end of the table at once
+	# Arguments:
+	#	min_params: (K, len(Parameter_Fields)) array of minimum parameter values
+	#	max_params: (K, len(Parameter_Fields)) array of maximum parameter values
+	#	param_weights: (K, len(Parameter_Fields)) array of parameter weights
+	#	base_weights: K base probability weights
+	#	message_ids: K message numbers
+	#	messages: MessageTable or list the message numbers refer to
+	def addRows(self, min_params, max_params, param_weights, base_weights, message_ids, messages):
+		k = len(base_weights)
+		if (self.size + k > len(self.base_weights)):
+			self.resize(max(2*self.size, self.size + k))
+
+		# Add the messages used to our own string table, and renumber
+		numbers = np.array([self.messages.add(m) for m in messages], dtype=np.int32)
+
+		rows = slice(self.size, self.size + k)
+		self.min_limits[rows] = min_params
+		self.max_limits[rows] = max_params
+		self.param_weights[rows] = param_weights
+		self.base_weights[rows] = base_weights
+		self.message_ids[rows] = numbers[np.asarray(message_ids, dtype=np.int64)] if (k > 0) else []
+		self.message_rows = None
+		self.size += k
+
+	# Function to append a chunk of parsed database rows. parseDatabaseRows has already rejected
+	#	rows whose values don't fit the table
+	# Arguments:
+	#	chunk: list of (line number, message, values) as yielded by readDatabaseChunks
+	#	db_fname: name of file the rows were read from, for the report
+	#	report: LoadReport to count loaded rows in
+	def addChunk(self, chunk, db_fname, report):
+		values = np.array([row[2] for row in chunk], dtype=np.int64).reshape(len(chunk), -1)
+		n_fields = len(Parameter_Fields)
+		self.addRows(
+			values[:, 1:n_fields+1],
+			values[:, n_fields+1:2*n_fields+1],
+			values[:, 2*n_fields+1:],
+			values[:, 0],
+			np.arange(len(chunk)),
+			[row[1] for row in chunk]
+		)
+		report.num_loaded += len(chunk)
+
+	# Function to append all rows of another table
+	# Arguments:
+	#	table: PossibilityTable to copy rows from
+	def addTable(self, table):
+		n = table.size
+		self.addRows(table.min_limits[:n], table.max_limits[:n], table.param_weights[:n], \
+			table.base_weights[:n], table.message_ids[:n], table.messages)
+
+	# Function to reallocate table arrays with a new capacity
+	# Arguments:
+	#	capacity: new number of rows. Must be at least the number of rows in use
+	def resize(self, capacity):
+		for name in ['min_limits', 'max_limits', 'param_weights', 'base_weights', 'message_ids']:
+			old = getattr(self, name)
+			new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+			new[:self.size] = old[:self.size]
+			setattr(self, name, new)
+
+	# Function which determines which rows' limits contain some Parameters
+	# Arguments:
+	#	params: Parameters under which we want to see which Possibilities can be chosen
+	# Return values:
+	#	mask: boolean array with one entry per row, true if all limits of that row are satisfied
+	def inLimits(self, params):
+		p = getParamsArray(params)
+		n = self.size
+		return np.all((self.min_limits[:n] <= p) & (p <= self.max_limits[:n]), axis=1)
+
+	# Function to return probability weights of every row under some Parameters.
+	#	Same as calling Possibility.getProb on every row
+	# Arguments:
+	#	params: Parameters under which we want to calculate weights
+	#	scoring: one of SCORING_MODES
+	# Return values:
+	#	weights: int array with one weight per row. Rows outside their limits get 0
+	def getWeights(self, params, scoring='base'):
+		rows = slice(0, self.size)
+		return np.where(self.inLimits(params), self.getRowWeights(rows, params, scoring), 0)
+
+	# Function to return probability weights of some rows under some Parameters, ignoring limits
+	# Arguments:
+	#	rows: row numbers (int array or slice)
+	#	params: Parameters under which we want to calculate weights
+	#	scoring: one of SCORING_MODES
+	# Return values:
+	#	weights: int array with one weight per row
+	def getRowWeights(self, rows, params, scoring='base'):
+		if (scoring == 'base'):
+			return self.base_weights[rows]
+
+		# Matrix-vector product of all rows' parameter weights with the Parameters. Summed in int64, since
+		#	base weights can be anywhere in int32
+		p = getParamsArray(params)
+		weights = self.base_weights[rows].astype(np.int64) + self.param_weights[rows] @ p
+		return np.maximum(weights, 0)
+
+	# Function to return probability weights of the rows found for each of a batch of Parameters
+	# Arguments:
+	#	indptr, rows: rows of each Parameters, as returned by PossibilityIndex.getRowsMany
+	#	params_batch: sequence of Parameters
+	#	scoring: one of SCORING_MODES
+	# Return values:
+	#	weights: int array with one weight per row. weights[indptr[i]:indptr[i + 1]] equals
+	#		getRowWeights(rows[indptr[i]:indptr[i + 1]], params_batch[i], scoring)
+	def getRowWeightsMany(self, indptr, rows, params_batch, scoring='base'):
+		if (scoring == 'base'):
+			return self.base_weights[rows]
+
+		# Row-wise dot products of the rows' parameter weights with their Parameters
+		p = getParamsArray(params_batch).reshape(-1, len(Parameter_Fields))
+		queries = np.repeat(np.arange(len(p)), np.diff(indptr))
+		weights = self.base_weights[rows].astype(np.int64) + \
+			np.einsum('ij,ij->i', self.param_weights[rows], p[queries])
+		return np.maximum(weights, 0)
+
+	# Function which determines which rows' limits contain each of a batch of Parameters
+	# Arguments:
+	#	params_batch: sequence of Parameters
+	# Return values:
+	#	mask: boolean array of shape (len(params_batch), N). Row i holds inLimits(params_batch[i])
+	def inLimitsMany(self, params_batch):
+		p = getParamsArray(params_batch).reshape(-1, len(Parameter_Fields))
+		n = self.size
+
+		# Check one parameter at a time to avoid building a (batch, N, fields) array
+		mask = np.ones((len(p), n), dtype=bool)
+		for f in range(len(Parameter_Fields)):
+			mask &= (self.min_limits[:n, f] <= p[:, f, None])
+			mask &= (p[:, f, None] <= self.max_limits[:n, f])
+		return mask
+
+	# Function to return probability weights of every row under a batch of Parameters at once
+	# Arguments:
+	#	params_batch: sequence of Parameters
+	#	scoring: one of SCORING_MODES
+	# Return values:
+	#	weights: int array of shape (len(params_batch), N). Row i holds getWeights(params_batch[i])
+	def getWeightsMany(self, params_batch, scoring='base'):
+		mask = self.inLimitsMany(params_batch)
+		n = self.size
+		if (scoring == 'base'):
+			return np.where(mask, self.base_weights[:n], 0)
+
+		# Matrix product of all rows' parameter weights with all Parameters
+		p = getParamsArray(params_batch).reshape(-1, len(Parameter_Fields))
+		weights = self.base_weights[:n].astype(np.int64) + p @ self.param_weights[:n].T
+		return np.where(mask, np.maximum(weights, 0), 0)
+
+	# Getter for the message of a row
+	# Arguments:
+	#	row: row number
+	# Return values:
+	#	message: message string
+	def getMsg(self, row):
+		return self.messages[self.message_ids[row]]
+
+	# Function to get the sorted rows with some message
+	# Arguments:
+	#	message: message string
+	# Return values:
+	#	rows: int array of row numbers
+	def getMsgRows(self, message):
+		number = self.messages.find(message)
+		if (number is None):
+			return np.zeros(0, dtype=np.int64)
+
+		# Rows grouped by message number, and where each message's group starts
+		if (self.message_rows is None):
+			order = np.argsort(self.message_ids[:self.size], kind='stable')
+			starts = np.searchsorted(self.message_ids[:self.size][order], np.arange(len(self.messages) + 1))
+			self.message_rows = (order, starts)
+
+		order, starts = self.message_rows
+		return order[starts[number]:starts[number + 1]]
+
+	# Function to make a Possibility object holding a copy of one row
+	# Arguments:
+	#	row: row number
+	# Return values:
+	#	possibility: Possibility
+	def getPossibility(self, row):
+		return Possibility(
+			Parameters(*self.min_limits[row].tolist()),
+			Parameters(*self.max_limits[row].tolist()),
+			Parameters(*self.param_weights[row].tolist()),
+			int(self.base_weights[row]),
+			self.getMsg(row)
+		)
+
+	# Function to estimate the memory used by the table
+	# Arguments:
+	#	None
+	# Return values:
+	#	num_bytes: approximate size in bytes, including unused capacity
+	def getNumBytes(self):
+		num_bytes = sum(getattr(self, name).nbytes \
+			for name in ['min_limits', 'max_limits', 'param_weights', 'base_weights', 'message_ids'])
+		if (self.messages.offsets is not None):
+			num_bytes += len(self.messages.blob) + self.messages.offsets.nbytes
+		return num_bytes + sum(sys.getsizeof(m) for m in self.messages.added)
+
+	# Function to use the arrays stored in a snapshot as this table's storage, without copying them.
+	#	Appending rows later copies the arrays out of the buffer
+	# Arguments:
+	#	buffer: buffer (bytes, mmap, shared memory, ...) holding a snapshot as made by packSnapshot
+	# Return values:
+	#	header: dict of snapshot header fields
+	def loadBuffer(self, buffer):
+		header = readSnapshotHeader(buffer)
+		n = header['num_rows']
+		layout = getSnapshotLayout(n, header['num_fields'], header['num_messages'])
+
+		limits = np.frombuffer(buffer, np.int8, 3*n*len(Parameter_Fields), layout['limits'])
+		limits = limits.reshape(3, n, len(Parameter_Fields))
+		self.min_limits, self.max_limits, self.param_weights = limits[0], limits[1], limits[2]
+		self.base_weights = np.frombuffer(buffer, np.int32, n, layout['base_weights'])
+		self.message_ids = np.frombuffer(buffer, np.int32, n, layout['message_ids'])
+		offsets = np.frombuffer(buffer, np.uint64, header['num_messages'] + 1, layout['offsets'])
+		blob = memoryview(buffer)[layout['blob']:layout['blob'] + header['blob_size']]
+		self.messages = MessageTable(blob, offsets)
+		self.message_rows = None
+		self.size = n
+		self.buffer = buffer
+		return header
+
+# PossibilityList object
+# Read only sequence of Possibilities backed by a PossibilityTable. Possibility objects are
+#	only made when accessed, so the table doesn't need one per row.
+class PossibilityList(collections.abc.Sequence):
+
+	# PossibilityList class constructor
+	# Arguments:
+	#	table: PossibilityTable holding the Possibilities
+	def __init__(self, table):
+		self.table = table
+
+	def __len__(self):
+		return self.table.size
+
+	def __getitem__(self, i):
+		if isinstance(i, slice):
+			return [self[j] for j in range(*i.indices(len(self)))]
+		if (i < 0):
+			i += len(self)
+		if not (0 <= i < len(self)):
+			raise IndexError('PossibilityList index out of range')
+		return self.table.getPossibility(i)
+
+# Function to group rows with identical limits, e.g. blocks of Possibilities which only differ
+#	in their message
+# Arguments:
+#	mins, maxs: (N, len(Parameter_Fields)) arrays of limits
+#	order: rows sorted so that rows with identical limits are next to each other, and ascending
+#		within each group. Defaults to sorting by all limits
+# Return values:
+#	order: see above
+#	starts: int array of G + 1 offsets into order where each of G groups' rows start
+def groupLimits(mins, maxs, order=None):
+	n = len(mins)
+	if (order is None):
+		order = np.lexsort(list(maxs.T) + list(mins.T)) if (n > 0) else np.zeros(0, dtype=np.int64)
+	if (n == 0):
+		return order, np.zeros(1, dtype=np.int64)
+	sorted_mins = mins[order]
+	sorted_maxs = maxs[order]
+	changed = np.any(sorted_mins[1:] != sorted_mins[:-1], axis=1) | np.any(sorted_maxs[1:] != sorted_maxs[:-1], axis=1)
+	return order, np.concatenate([[0], np.flatnonzero(changed) + 1, [n]])
+
+# Function to get the rows of some groups made by groupLimits
+# Arguments:
+#	groups: int array of group numbers
+#	order, starts: see groupLimits
+# Return values:
+#	rows: sorted int array of all rows in the groups
+def expandGroups(groups, order, starts):
+	lengths = starts[groups + 1] - starts[groups]
+	ends = np.cumsum(lengths)
+	total = int(ends[-1]) if (len(ends) > 0) else 0
+	positions = np.arange(total) + np.repeat(starts[groups] - (ends - lengths), lengths)
+	return np.sort(order[positions])
+
+# PossibilityIndex object
+# Packed R-tree over the limit boxes of a PossibilityTable, used to skip rows which can't fit
+#	some Parameters. Rows are sorted so that rows with similar limits sit next to each other,
+#	and rows with identical limits are indexed once as a group (see groupLimits). The distinct
+#	boxes are grouped into nodes of `fanout` boxes, nodes into parent nodes of `fanout` nodes, and so on.
+#	Each node stores the box bounding all of its boxes, so a query only descends into nodes whose
+#	box contains the Parameters, instead of checking every row.
+# Rows appended after the index was built are kept in an unindexed tail which is checked row by row,
+#	until it grows large enough for the index to be rebuilt.
+class PossibilityIndex:
+
+	# PossibilityIndex class constructor
+	# Arguments:
+	#	table: PossibilityTable to index
+	#	fanout: number of children per node
+	def __init__(self, table, fanout=32):
+		self.table = table
+		self.fanout = fanout
+		self.rebuild()
+
+	# Function to build the tree from scratch over all rows currently in the table
+	def rebuild(self):
+		n = self.table.size
+		self.built_size = n
+		mins = self.table.min_limits[:n]
+		maxs = self.table.max_limits[:n]
+
+		# Sort rows by their limits, most selective parameters (narrowest ranges) first
+		widths = (maxs - mins).mean(axis=0) if (n > 0) else np.zeros(len(Parameter_Fields))
+		keys = []
+		for f in np.argsort(widths)[::-1]:
+			keys += [maxs[:, f], mins[:, f]]
+		order = np.lexsort(keys).astype(np.int32) if (n > 0) else np.zeros(0, dtype=np.int32)
+
+		# Rows with identical limits are next to each other now. Each distinct box is checked once
+		self.order, self.group_starts = groupLimits(mins, maxs, order)
+		self.box_mins = mins[self.order[self.group_starts[:-1]]]
+		self.box_maxs = maxs[self.order[self.group_starts[:-1]]]
+
+		# Build node boxes bottom up, until a single level has at most fanout nodes.
+		#	levels[0] is the root level
+		self.levels = []
+		box_mins, box_maxs = self.box_mins, self.box_maxs
+		while (len(box_mins) > self.fanout):
+			box_mins, box_maxs = self.groupBoxes(box_mins, box_maxs)
+			self.levels.insert(0, (box_mins, box_maxs))
+
+	# Function to compute the bounding boxes of consecutive groups of fanout boxes
+	# Arguments:
+	#	box_mins, box_maxs: (M, len(Parameter_Fields)) arrays of box limits
+	# Return values:
+	#	group_mins, group_maxs: (ceil(M / fanout), len(Parameter_Fields)) arrays of bounding boxes
+	def groupBoxes(self, box_mins, box_maxs):
+		m = len(box_mins)
+		num_groups = -(-m // self.fanout)
+		pad = num_groups*self.fanout - m
+		info = np.iinfo(box_mins.dtype)
+
+		# Pad with empty boxes which don't widen the bounding box
+		padded_mins = np.concatenate([box_mins, np.full((pad, box_mins.shape[1]), info.max, box_mins.dtype)])
+		padded_maxs = np.concatenate([box_maxs, np.full((pad, box_maxs.shape[1]), info.min, box_maxs.dtype)])
+
+		shape = (num_groups, self.fanout, box_mins.shape[1])
+		return padded_mins.reshape(shape).min(axis=1), padded_maxs.reshape(shape).max(axis=1)
+
+	# Function to add a row appended to the table to the index
+	# Arguments:
+	#	row: index of the new row in the table
+	def addRow(self, row):
+		# The new row stays in the unindexed tail until the tail is worth indexing
+		if (self.table.size - self.built_size > max(1024, self.built_size // 8)):
+			self.rebuild()
+
+	# Function to find all rows of the table whose limits contain some Parameters
+	# Arguments:
+	#	params: Parameters to look up
+	# Return values:
+	#	rows: sorted int array of row numbers
+	def getRows(self, params):
+		p = getParamsArray(params)
+
+		# Descend the tree, keeping only nodes whose box contains the Parameters
+		nodes = None
+		for box_mins, box_maxs in self.levels + [(self.box_mins, self.box_maxs)]:
+			if (nodes is None):
+				children = np.arange(len(box_mins))
+			else:
+				children = (nodes[:, None]*self.fanout + np.arange(self.fanout)).ravel()
+				children = children[children < len(box_mins)]
+			fits = np.all((box_mins[children] <= p) & (p <= box_maxs[children]), axis=1)
+			nodes = children[fits]
+		rows = expandGroups(nodes, self.order, self.group_starts)
+
+		# Check the unindexed tail
+		n = self.table.size
+		if (n > self.built_size):
+			fits = np.all((self.table.min_limits[self.built_size:n] <= p) & \
+				(p <= self.table.max_limits[self.built_size:n]), axis=1)
+			rows = np.concatenate([rows, self.built_size + np.flatnonzero(fits)])
+
+		return rows
+
+	# Function to find the rows of the table whose limits contain each of a batch of Parameters,
+	#	descending the tree for the whole batch at once
+	# Arguments:
+	#	params_batch: sequence of Parameters
+	# Return values:
+	#	indptr: int array of len(params_batch) + 1 offsets into rows
+	#	rows: int array of rows. rows[indptr[i]:indptr[i + 1]] equals getRows(params_batch[i])
+	def getRowsMany(self, params_batch):
+		p = getParamsArray(params_batch).reshape(-1, len(Parameter_Fields))
+
+		# Descend the tree with (query, node) pairs, keeping only nodes whose box contains the query.
+		#	Pairs stay sorted by query
+		queries = nodes = None
+		for box_mins, box_maxs in self.levels + [(self.box_mins, self.box_maxs)]:
+			if (nodes is None):
+				queries = np.repeat(np.arange(len(p)), len(box_mins))
+				children = np.tile(np.arange(len(box_mins)), len(p))
+			else:
+				queries = np.repeat(queries, self.fanout)
+				children = (nodes[:, None]*self.fanout + np.arange(self.fanout)).ravel()
+				valid = (children < len(box_mins))
+				queries, children = queries[valid], children[valid]
+			fits = np.all((box_mins[children] <= p[queries]) & (p[queries] <= box_maxs[children]), axis=1)
+			queries, nodes = queries[fits], children[fits]
+
+		# Expand each pair's group to its rows
+		lengths = self.group_starts[nodes + 1] - self.group_starts[nodes]
+		ends = np.cumsum(lengths)
+		total = int(ends[-1]) if (len(ends) > 0) else 0
+		positions = np.arange(total) + np.repeat(self.group_starts[nodes] - (ends - lengths), lengths)
+		rows = self.order[positions]
+		indptr = np.concatenate([[0], ends])[np.searchsorted(queries, np.arange(len(p) + 1))]
+
+		# Each group's rows are ascending, but groups interleave. Sort the rows of queries where they do
+		descending = np.flatnonzero(rows[1:] < rows[:-1]) + 1
+		for i in np.unique(np.searchsorted(indptr, descending, side='right') - 1):
+			rows[indptr[i]:indptr[i + 1]].sort()
+
+		# Check the unindexed tail, one parameter at a time. Its rows come after all indexed rows
+		n = self.table.size
+		if (n > self.built_size):
+			mask = np.ones((len(p), n - self.built_size), dtype=bool)
+			for f in range(len(Parameter_Fields)):
+				mask &= (self.table.min_limits[self.built_size:n, f] <= p[:, f, None])
+				mask &= (p[:, f, None] <= self.table.max_limits[self.built_size:n, f])
+			tail_queries, tail_rows = np.nonzero(mask)
+			queries = np.concatenate([np.repeat(np.arange(len(p)), np.diff(indptr)), tail_queries])
+			order = np.argsort(queries, kind='stable')
+			rows = np.concatenate([rows, self.built_size + tail_rows])[order]
+			indptr = np.searchsorted(queries[order], np.arange(len(p) + 1))
+
+		return indptr, rows
+
+# FeasibilityTracker object
+# Finds the rows which fit a stream of Parameters, where consecutive Parameters usually differ in only
+#	one or two fields, like a GUI with one slider moved at a time.
+# Keeps one bitmask per parameter of the groups of rows with identical limits (see groupLimits) whose
+#	limits contain that parameter's value, as packed 64 bit words, and ANDs them together. A new
+#	Parameters only needs new masks for the fields which changed. Masks only change where some row's
+#	limits start or end, so masks are cached by the interval between those breakpoints the value
+#	falls in, and revisiting a value costs a lookup.
+# Holds the last Parameters, so each stream of queries (thread, session) needs its own tracker
+class FeasibilityTracker:
+
+	# FeasibilityTracker class constructor
+	# Arguments:
+	#	table: PossibilityTable to track. Rows appended later are picked up on the next query
+	#	max_masks: maximum number of cached masks per parameter
+	def __init__(self, table, max_masks=MAX_TRACKED_MASKS):
+		self.table = table
+		self.max_masks = max_masks
+		self.reset()
+
+	# Function to forget all masks, e.g. when rows were added to the table
+	def reset(self):
+		n = self.size = self.table.size
+		self.order, self.group_starts = groupLimits(self.table.min_limits[:n], self.table.max_limits[:n])
+		self.box_mins = self.table.min_limits[:n][self.order[self.group_starts[:-1]]]
+		self.box_maxs = self.table.max_limits[:n][self.order[self.group_starts[:-1]]]
+		self.num_groups = len(self.group_starts) - 1
+		self.num_words = -(-self.num_groups // 64)
+
+		# Values where each parameter's mask may change: every min limit, and one past every max limit
+		self.breakpoints = [np.unique(np.concatenate([self.box_mins[:, f].astype(np.int32), \
+			self.box_maxs[:, f].astype(np.int32) + 1])) for f in range(len(Parameter_Fields))]
+		self.cached_masks = [collections.OrderedDict() for f in Parameter_Fields]
+		self.params = None
+		self.masks = [None]*len(Parameter_Fields)
+
+	# Function to get the mask of groups whose limits contain one parameter's value
+	# Arguments:
+	#	f: index of parameter in Parameter_Fields
+	#	value: value of parameter
+	# Return values:
+	#	mask: uint64 array with one bit per group, group i being bit i % 64 of word i // 64
+	def getFieldMask(self, f, value):
+		interval = int(np.searchsorted(self.breakpoints[f], value, side='right'))
+		cached = self.cached_masks[f]
+		mask = cached.get(interval)
+		if (mask is not None):
+			cached.move_to_end(interval)
+			return mask
+
+		fits = (self.box_mins[:, f] <= value) & (value <= self.box_maxs[:, f])
+		mask = np.zeros(8*self.num_words, dtype=np.uint8)
+		mask[:-(-self.num_groups // 8)] = np.packbits(fits, bitorder='little')
+		mask = mask.view('<u8')
+		cached[interval] = mask
+		if (len(cached) > self.max_masks):
+			cached.popitem(last=False)
+		return mask
+
+	# Function to get the rows whose limits contain some Parameters
+	# Arguments:
+	#	params: Parameters
+	# Return values:
+	#	rows: sorted int array of rows, same as PossibilityIndex.getRows
+	def getRows(self, params):
+		if (self.size != self.table.size):
+			self.reset()
+
+		# Only the fields which changed since the last Parameters need new masks
+		for f in range(len(Parameter_Fields)):
+			if (self.params is None) or (self.params[f] != params[f]):
+				self.masks[f] = self.getFieldMask(f, params[f])
+		self.params = tuple(params)
+		if (self.num_words == 0):
+			return np.zeros(0, dtype=np.int64)
+
+		# Unpack only the words with any bit set
+		combined = np.bitwise_and.reduce(self.masks)
+		words = np.flatnonzero(combined)
+		bits = np.unpackbits(combined[words].view(np.uint8), bitorder='little').reshape(len(words), 64)
+		word_index, bit_index = np.nonzero(bits)
+		return expandGroups(words[word_index]*64 + bit_index, self.order, self.group_starts)
+
+# Candidates object
+# The Possibilities which fit some Parameters, with cumulative weights ready for weighted random choice
+# Candidates are immutable once built, so Parameters which fit the same rows can share them
+class Candidates:
+	__slots__ = ['rows', 'cum_weights', 'total_weight', 'num_nonzero', 'alias_probs', 'alias_indices', \
+		'__weakref__']
+
+	# Candidates class constructor
+	# Arguments:
+	#	rows: int array of table rows (numpy backend), or None if weights covers all Possibilities
+	#	weights: list or array of weights of the Possibilities in rows
+	def __init__(self, rows, weights):
+		self.rows = rows
+		if (np is not None) and isinstance(weights, np.ndarray):
+			self.cum_weights = np.cumsum(weights)
+			self.num_nonzero = int(np.count_nonzero(weights))
+		else:
+			self.cum_weights = list(itertools.accumulate(weights))
+			self.num_nonzero = len([w for w in weights if w != 0])
+		self.total_weight = self.cum_weights[-1] if (len(self.cum_weights) > 0) else 0
+
+		# Alias table, only built for the alias sampler
+		self.alias_probs = None
+		self.alias_indices = None
+
+	# Function to get a key identifying the rows and weights of these Candidates
+	# Arguments:
+	#	None
+	# Return values:
+	#	signature: bytes, equal for Candidates with equal rows and weights
+	def getSignature(self):
+		if isinstance(self.cum_weights, list):
+			return hashlib.blake2b(repr(self.cum_weights).encode(), digest_size=16).digest()
+		return hashlib.blake2b(self.rows.tobytes() + self.cum_weights.tobytes(), digest_size=16).digest()
+
+	# Function to build the alias table used by draw, using Vose's method. Does nothing if already built
+	def buildAlias(self):
+		if (self.alias_probs is not None) or (self.total_weight == 0):
+			return
+		n = len(self.cum_weights)
+
+		# Scale weights so they average 1
+		scale = n / (self.total_weight + 0.0)
+		probs = [self.getWeight(i)*scale for i in range(n)]
+		indices = list(range(n))
+
+		# Pair each candidate below average with one above average to fill up its slot
+		small = [i for i in range(n) if (probs[i] < 1.0)]
+		large = [i for i in range(n) if (probs[i] >= 1.0)]
+		while (len(small) > 0) and (len(large) > 0):
+			s = small.pop()
+			l = large.pop()
+			indices[s] = l
+			probs[l] -= 1.0 - probs[s]
+			if (probs[l] < 1.0):
+				small.append(l)
+			else:
+				large.append(l)
+
+		# Whatever is left is only off from 1 by rounding error
+		for i in small + large:
+			probs[i] = 1.0
+
+		# Set alias_probs last, since draw checks it. Other threads may be drawing from these Candidates
+		self.alias_indices = indices
+		self.alias_probs = probs
+
+	# Function to make a weighted random choice of candidate.
+	#	With the alias table built, this takes one random number and constant time.
+	#	Otherwise, consumes the same random numbers and picks the same candidate as
+	#	random.choices(candidates, weights)
+	# Arguments:
+	#	rng: random number generator, e.g. a random.Random. Defaults to the random module
+	# Return values:
+	#	index: index of chosen candidate. Must not be called if total_weight is 0
+	def draw(self, rng=random):
+		if (self.alias_probs is not None):
+			x = rng.random() * len(self.alias_probs)
+			i = int(x)
+			return i if ((x - i) < self.alias_probs[i]) else self.alias_indices[i]
+
+		x = rng.random() * (self.total_weight + 0.0)
+		return bisect.bisect(self.cum_weights, x, 0, len(self.cum_weights) - 1)
+
+	# Function to get the weight of one candidate
+	# Arguments:
+	#	i: index of the candidate
+	# Return values:
+	#	weight: weight of the candidate
+	def getWeight(self, i):
+		return self.cum_weights[i] - (self.cum_weights[i - 1] if (i > 0) else 0)
+
+	# Function to make a weighted random choice of candidate, leaving some candidates out.
+	#	Draws exactly once, with the same distribution as drawing until a candidate which
+	#	isn't left out comes up
+	# Arguments:
+	#	excluded: sorted list of indices of candidates to leave out
+	#	rng: random number generator, see draw
+	# Return values:
+	#	index: index of chosen candidate, or None if all candidates with nonzero weight are left out
+	def drawExcluding(self, excluded, rng=random):
+		excluded_weights = [self.getWeight(i) for i in excluded]
+		remaining_weight = self.total_weight - sum(excluded_weights)
+		if (remaining_weight <= 0):
+			return None
+
+		# Draw from the remaining weight, then skip over the left out candidates' shares of cum_weights
+		x = rng.random() * (remaining_weight + 0.0)
+		for i, w in zip(excluded, excluded_weights):
+			if (x < self.cum_weights[i] - w):
+				break
+			x += w
+		return bisect.bisect(self.cum_weights, x, 0, len(self.cum_weights) - 1)
+
+	# Function to estimate the memory used by these Candidates
+	# Arguments:
+	#	None
+	# Return values:
+	#	num_bytes: approximate size in bytes
+	def getNumBytes(self):
+		if isinstance(self.cum_weights, list):
+			# One list slot plus one int object per weight
+			num_bytes = 64 + 36*len(self.cum_weights)
+		else:
+			num_bytes = 64 + self.rows.nbytes + self.cum_weights.nbytes
+
+		# Alias table lists hold one float and one int per candidate
+		if (self.alias_probs is not None):
+			num_bytes += 68*len(self.alias_probs)
+		return num_bytes
+
+# Distributions object
+# Probabilities of the messages which can be chosen under each of a batch of Parameters, stored like a
+#	sparse matrix in CSR form: the entries of Parameters i are indptr[i]:indptr[i + 1] of message_ids
+#	and probs, most probable first. message_ids index into messages. Only messages with nonzero
+#	probability have entries, so Parameters where choose answers with EIGHT_BALL have none
+class Distributions:
+	__slots__ = ['indptr', 'message_ids', 'probs', 'messages']
+
+	# Distributions class constructor
+	# Arguments:
+	#	indptr: int array (numpy backend) or list of len(params_batch) + 1 offsets into message_ids and probs
+	#	message_ids: int array or list of message numbers
+	#	probs: float array or list of probabilities
+	#	messages: sequence of message strings the message numbers index into
+	def __init__(self, indptr, message_ids, probs, messages):
+		self.indptr = indptr
+		self.message_ids = message_ids
+		self.probs = probs
+		self.messages = messages
+
+	def __len__(self):
+		return len(self.indptr) - 1
+
+	# Function to get the distribution under one of the Parameters
+	# Arguments:
+	#	i: index of the Parameters in the batch
+	# Return values:
+	#	distribution: list of (message, probability) pairs, most probable first
+	def getRow(self, i):
+		start, stop = self.indptr[i], self.indptr[i + 1]
+		return [(self.messages[int(number)], float(prob)) \
+			for number, prob in zip(self.message_ids[start:stop], self.probs[start:stop])]
+
+# CandidateCache object
+# Least recently used cache of Candidates, keyed by Parameters values.
+# Holds at most max_bytes worth of Candidates, evicting the least recently used ones first.
+# Parameters which fit the same rows with the same weights share one Candidates object,
+#	so its cumulative weights and alias table are only built once.
+# Safe to share between threads. Cached Candidates are never modified. Hits don't take the lock:
+#	the entries are read without it, and the hit is queued. Queued hits are counted and moved to the
+#	end of the LRU order by the next miss, put or getStats, or once MAX_CACHE_TOUCHED are queued.
+#	Hits made by other threads during a put may be applied after its evictions
+class CandidateCache:
+
+	# CandidateCache class constructor
+	# Arguments:
+	#	max_bytes: memory bound of the cache, as measured by Candidates.getNumBytes
+	def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+		self.max_bytes = max_bytes
+		self.entries = collections.OrderedDict()
+		self.num_bytes = 0
+
+		# Cached Candidates by signature. Shared ones are counted against max_bytes once per key
+		self.shared = weakref.WeakValueDictionary()
+
+		# Lookup counters
+		self.hits = 0
+		self.misses = 0
+
+		# Keys of hits not yet counted and moved to the end of entries. Appended without the lock
+		self.touched = collections.deque()
+
+		# Guards changes to entries, shared and the counters
+		self.lock = threading.Lock()
+
+	# Function to look up Candidates
+	# Arguments:
+	#	key: tuple of Parameters values
+	# Return values:
+	#	candidates: cached Candidates, or None if not cached
+	def get(self, key):
+		# A single dict lookup is atomic, so hits read the entries without the lock
+		entry = self.entries.get(key)
+		if (entry is None):
+			with self.lock:
+				self.applyTouched()
+				self.misses += 1
+			return None
+
+		# Queue the hit, to be counted and moved to the end of the LRU order by the next lock holder
+		touched = self.touched
+		touched.append(key)
+		if (len(touched) > MAX_CACHE_TOUCHED):
+			with self.lock:
+				self.applyTouched()
+		return entry[0]
+
+	# Function to count the queued hits, and move their keys to the end of the LRU order.
+	#	Must be called with the lock held
+	def applyTouched(self):
+		while (len(self.touched) > 0):
+			key = self.touched.popleft()
+			self.hits += 1
+			if (key in self.entries):
+				self.entries.move_to_end(key)
+
+	# Function to find cached Candidates equal to some new ones
 	# Arguments:
-	#	db_fname: name of file to read in Possibility data from
-	def __init__(self, db_fname):
+	#	candidates: new Candidates
+	# Return values:
+	#	candidates: Candidates to use from now on. Either the given ones, or equal ones already cached
+	def share(self, candidates):
+		signature = candidates.getSignature()
+		with self.lock:
+			return self.shared.setdefault(signature, candidates)
+
+	# Function to add Candidates to the cache, evicting old ones if over the memory bound
+	# Arguments:
+	#	key: tuple of Parameters values
+	#	candidates: Candidates to cache, as returned by share
+	def put(self, key, candidates):
+		num_bytes = candidates.getNumBytes()
+		with self.lock:
+			self.applyTouched()
+			if (num_bytes > self.max_bytes) or (key in self.entries):
+				return
+
+			self.entries[key] = (candidates, num_bytes)
+			self.num_bytes += num_bytes
+			while (self.num_bytes > self.max_bytes):
+				old_key, (old_candidates, old_num_bytes) = self.entries.popitem(last=False)
+				self.num_bytes -= old_num_bytes
+
+	# Function to drop all cached Candidates, e.g. when the Possibilities change
+	def clear(self):
+		with self.lock:
+			self.entries.clear()
+			self.shared.clear()
+			self.num_bytes = 0
+
+	# Function to get cache statistics
+	# Arguments:
+	#	None
+	# Return values:
+	#	stats: dict with hit and miss counts, number of entries and memory used
+	def getStats(self):
+		with self.lock:
+			self.applyTouched()
+			return {
+				'hits': self.hits,
+				'misses': self.misses,
+				'entries': len(self.entries),
+				'shared': len(self.shared),
+				'bytes': self.num_bytes,
+				'max_bytes': self.max_bytes
+			}
+
+# LoadReport object
+# Counts of database lines loaded, skipped (comments and empty lines) and rejected (malformed lines),
+#	with the file, line number and reason of the first rejected lines
+class LoadReport:
+
+	# LoadReport class constructor
+	# Arguments:
+	#	max_rejects: maximum number of rejected lines to keep reasons for
+	def __init__(self, max_rejects=MAX_REPORTED_REJECTS):
+		self.max_rejects = max_rejects
+		self.num_loaded = 0
+		self.num_skipped = 0
+		self.num_rejected = 0
+
+		# List of (file name, line number, reason)
+		self.rejects = []
+
+	# Function to record a rejected line
+	# Arguments:
+	#	db_fname: name of file the line is in
+	#	line: line number, starting at 1
+	#	reason: string describing what's wrong with the line
+	def reject(self, db_fname, line, reason):
+		self.num_rejected += 1
+		if (len(self.rejects) < self.max_rejects):
+			self.rejects.append((db_fname, line, reason))
+
+	# Function to add the counts and rejects of another report to this one
+	# Arguments:
+	#	report: LoadReport to add
+	def merge(self, report):
+		self.num_loaded += report.num_loaded
+		self.num_skipped += report.num_skipped
+		self.num_rejected += report.num_rejected
+		self.rejects += report.rejects[:self.max_rejects - len(self.rejects)]
+
+	# Function to describe the report
+	# Arguments:
+	#	None
+	# Return values:
+	#	summary: multi line string with counts, then one line per kept reject
+	def getSummary(self):
+		lines = ['{} rows loaded, {} lines skipped, {} lines rejected'.format(
+			self.num_loaded, self.num_skipped, self.num_rejected)]
+		lines += ['{}:{}: {}'.format(*reject) for reject in self.rejects]
+		if (self.num_rejected > len(self.rejects)):
+			lines.append('... {} more rejected lines'.format(self.num_rejected - len(self.rejects)))
+		return '\n'.join(lines)
+
+# Histogram object
+# Counts of observed values per bucket, and their sum
+class Histogram:
+	__slots__ = ['bounds', 'counts', 'sum', 'count']
+
+	# Histogram class constructor
+	# Arguments:
+	#	bounds: sorted upper bounds of buckets. Values over the last bound are counted in an extra bucket
+	def __init__(self, bounds):
+		self.bounds = list(bounds)
+		self.counts = [0]*(len(self.bounds) + 1)
+		self.sum = 0
+		self.count = 0
+
+	# Function to count a value
+	# Arguments:
+	#	value: observed value
+	def observe(self, value):
+		self.counts[bisect.bisect_left(self.bounds, value)] += 1
+		self.sum += value
+		self.count += 1
+
+	# Function to get the cumulative counts of each bucket
+	# Arguments:
+	#	None
+	# Return values:
+	#	buckets: list of (upper bound, number of values at most that bound), ending with infinity
+	def getBuckets(self):
+		return list(zip(self.bounds + [float('inf')], itertools.accumulate(self.counts)))
+
+# Metrics object
+# Counters and histograms recorded by a DecisionMaker, see METRICS. Can be read in process with
+#	getStats, or as Prometheus text with getPrometheusText. Safe to share between threads
+class Metrics:
+
+	# Metrics class constructor
+	# Arguments:
+	#	definitions: list of (name, type, histogram buckets, description)
+	def __init__(self, definitions=METRICS):
+		self.lock = threading.Lock()
+		self.descriptions = {}
+		self.counters = {}
+		self.histograms = {}
+		for name, kind, bounds, description in definitions:
+			self.descriptions[name] = description
+			if (kind == 'counter'):
+				self.counters[name] = 0
+			else:
+				self.histograms[name] = Histogram(bounds)
+
+	# Function to add to a counter
+	# Arguments:
+	#	name: name of counter
+	#	amount: amount to add
+	def increment(self, name, amount=1):
+		with self.lock:
+			self.counters[name] += amount
+
+	# Function to count a value in a histogram
+	# Arguments:
+	#	name: name of histogram
+	#	value: observed value
+	def observe(self, name, value):
+		with self.lock:
+			self.histograms[name].observe(value)
+
+	# Function to get all metrics
+	# Arguments:
+	#	None
+	# Return values:
+	#	stats: dict of counter values by name, and of histograms by name as dicts of cumulative
+	#		buckets, sum and count
+	def getStats(self):
+		with self.lock:
+			stats = dict(self.counters)
+			for name, histogram in self.histograms.items():
+				stats[name] = {'buckets': histogram.getBuckets(), 'sum': histogram.sum, 'count': histogram.count}
+		return stats
+
+	# Function to format all metrics in the Prometheus text exposition format
+	# Arguments:
+	#	gauges: dict of extra values by name to include as gauges
+	#	prefix: prefix of every metric name
+	# Return values:
+	#	text: metrics, one sample per line
+	def getPrometheusText(self, gauges={}, prefix='decisionmaker_'):
+		stats = self.getStats()
+		lines = []
+		for name, value in list(stats.items()) + list(gauges.items()):
+			full_name = prefix + name
+			if (name in self.descriptions):
+				lines.append('# HELP {} {}'.format(full_name, self.descriptions[name]))
+			if isinstance(value, dict):
+				lines.append('# TYPE {} histogram'.format(full_name))
+				for bound, count in value['buckets']:
+					lines.append('{}_bucket{{le="{}"}} {}'.format(full_name, '+Inf' if (bound == float('inf')) else \
+						repr(bound), count))
+				lines.append('{}_sum {}'.format(full_name, value['sum']))
+				lines.append('{}_count {}'.format(full_name, value['count']))
+			else:
+				lines.append('# TYPE {} {}'.format(full_name, 'gauge' if (name in gauges) else 'counter'))
+				lines.append('{} {}'.format(full_name, value))
+		return '\n'.join(lines) + '\n'
+
+# Function to read the lines of a tab separated database file one at a time.
+#	Files ending in ODS_EXT are read as spreadsheets instead, see readOdsLines
+# Arguments:
+#	db_fname: name of database file
+# Return values:
+#	generator yielding (line number, list of fields)
+def readDatabaseLines(db_fname):
+	if (db_fname.endswith(ODS_EXT)):
+		yield from readOdsLines(db_fname)
+		return
+	with open(db_fname, 'r', newline='') as fptr:
+		reader = csv.reader(fptr, delimiter='\t')
+		for fields in reader:
+			yield reader.line_num, fields
+
+# Function to get the text of an element of a spreadsheet cell, expanding space, tab and line break elements
+# Arguments:
+#	element: ElementTree element
+# Return values:
+#	text: string
+def getOdsText(element):
+	parts = [element.text or '']
+	for child in element:
+		if (child.tag == ODS_TEXT + 's'):
+			parts.append(' '*int(child.get(ODS_TEXT + 'c', 1)))
+		elif (child.tag == ODS_TEXT + 'tab'):
+			parts.append('\t')
+		elif (child.tag == ODS_TEXT + 'line-break'):
+			parts.append('\n')
+		elif (child.tag != ODS_OFFICE + 'annotation'):
+			parts.append(getOdsText(child))
+		parts.append(child.tail or '')
+	return ''.join(parts)
+
+# Function to get the fields of a spreadsheet row. Numbers are read from their value rather than
+#	their formatted text. Empty cells at the end of the row are left out, like in an exported file
+# Arguments:
+#	row: ElementTree element of the row
+# Return values:
+#	fields: list of strings
+def readOdsRow(row):
+	fields = []
+	# Empty cells are only added once a cell with a value follows them
+	num_empty = 0
+	for cell in row:
+		if (cell.tag != ODS_TABLE + 'table-cell') and (cell.tag != ODS_TABLE + 'covered-table-cell'):
+			continue
+		repeat = int(cell.get(ODS_TABLE + 'number-columns-repeated', 1))
+		if (cell.get(ODS_OFFICE + 'value') is not None):
+			value = cell.get(ODS_OFFICE + 'value')
+		else:
+			value = '\n'.join([getOdsText(paragraph) for paragraph in cell.findall(ODS_TEXT + 'p')])
+		if (len(value) == 0):
+			num_empty += repeat
+			continue
+		fields += ['']*num_empty + [value]*repeat
+		num_empty = 0
+	return fields
+
+# Function to read the rows of the first sheet of a spreadsheet database file one at a time.
+#	The content file is streamed out of the zip and parsed incrementally, and each row is dropped
+#	once read, so memory use doesn't grow with the sheet. Repeated rows and cells are expanded,
+#	except empty ones at the end of the sheet or of a row, which spreadsheets write with huge repeat counts
+# Arguments:
+#	db_fname: name of spreadsheet file
+# Return values:
+#	generator yielding (row number, list of fields)
+def readOdsLines(db_fname):
+	line = 0
+	# Empty rows are only yielded once a row with fields follows them
+	num_empty = 0
+	with zipfile.ZipFile(db_fname) as archive, archive.open(ODS_CONTENT) as fptr:
+		# Elements being parsed, outermost first
+		parents = []
+		for event, element in ElementTree.iterparse(fptr, events=('start', 'end')):
+			if (event == 'start'):
+				parents.append(element)
+				continue
+			parents.pop()
+			if (element.tag == ODS_TABLE + 'table'):
+				return
+			if (element.tag != ODS_TABLE + 'table-row'):
+				continue
+
+			fields = readOdsRow(element)
+			repeat = int(element.get(ODS_TABLE + 'number-rows-repeated', 1))
+			element.clear()
+			parents[-1].remove(element)
+			if (len(fields) == 0):
+				num_empty += repeat
+				continue
+			for i in range(num_empty):
+				yield line + i + 1, []
+			line += num_empty
+			for i in range(repeat):
+				yield line + i + 1, fields
+			line += repeat
+			num_empty = 0
+
+# Function to parse database lines into rows, skipping comment and empty lines and
+#	rejecting malformed ones
+# Arguments:
+#	lines: iterable of (line number, list of fields)
+#	db_fname: name of file the lines are from, for the report
+#	report: LoadReport to count skipped and rejected lines in
+# Return values:
+#	generator yielding (line number, message, values), where values is a list of ints: base weight,
+#		then min limits, max limits and weights of each parameter
+def parseDatabaseRows(lines, db_fname, report):
+	n_fields = 3*len(Parameter_Fields) + 2
+	for line, fields in lines:
+		# Ignore comment lines and empty lines
+		if (len(fields) == 0) or (fields[0].startswith('#')) or not any(fields):
+			report.num_skipped += 1
+			continue
+
+		# Reject malformed lines
+		if (len(fields) != n_fields):
+			report.reject(db_fname, line, 'expected {} fields, found {}'.format(n_fields, len(fields)))
+			continue
+		if (len(fields[0]) == 0):
+			report.reject(db_fname, line, 'missing message')
+			continue
+		values = []
+		for i in range(1, n_fields):
+			try:
+				values.append(int(fields[i]))
+			except ValueError:
+				report.reject(db_fname, line, 'field {} is not an integer: \'{}\''.format(i + 1, fields[i]))
+				break
+		if (len(values) != n_fields - 1):
+			continue
+
+		# Reject values which don't fit the table: base weights are int32, limits and weights int8
+		if not (-2**31 <= values[0] < 2**31):
+			report.reject(db_fname, line, 'base weight must be in range [-2^31 2^31), found {}'.format(values[0]))
+			continue
+		if (min(values[1:]) < -128) or (max(values[1:]) > 127):
+			i = next(i for i in range(1, n_fields - 1) if not (-128 <= values[i] <= 127))
+			report.reject(db_fname, line, 'field {} must be in range [-128 127], found {}'.format(i + 2, values[i]))
+			continue
+
+		yield line, fields[0], values
+
+# Function to read a database file as chunks of parsed rows, so that only one chunk of
+#	rows is held in memory at a time
+# Arguments:
+#	db_fname: name of database file
+#	report: LoadReport to count skipped and rejected lines in
+#	chunk_size: maximum number of rows per chunk
+# Return values:
+#	generator yielding lists of (line number, message, values), see parseDatabaseRows
+def readDatabaseChunks(db_fname, report, chunk_size=LOAD_CHUNK_SIZE):
+	rows = parseDatabaseRows(readDatabaseLines(db_fname), db_fname, report)
+	while True:
+		chunk = list(itertools.islice(rows, chunk_size))
+		if (len(chunk) == 0):
+			return
+		yield chunk
+
+# Function to load a database file into new storage. Used to load shards concurrently
+# Arguments:
+#	db_fname: name of database file
+#	backend: one of BACKENDS
+#	max_rejects: maximum number of rejected lines to keep reasons for
+#	table: PossibilityTable to append to instead of a new one (numpy backend only)
+# Return values:
+#	storage: PossibilityTable (numpy backend) or list of Possibilities (python backend)
+#	report: LoadReport
+def loadDatabase(db_fname, backend, max_rejects=MAX_REPORTED_REJECTS, table=None):
+	report = LoadReport(max_rejects)
+	n_fields = len(Parameter_Fields)
+	if (backend == 'numpy'):
+		storage = PossibilityTable() if (table is None) else table
+		for chunk in readDatabaseChunks(db_fname, report):
+			storage.addChunk(chunk, db_fname, report)
+	else:
+		storage = []
+		for chunk in readDatabaseChunks(db_fname, report):
+			for line, message, values in chunk:
+				storage.append(Possibility(
+					Parameters(*values[1:n_fields+1]),
+					Parameters(*values[n_fields+1:2*n_fields+1]),
+					Parameters(*values[2*n_fields+1:]),
+					values[0],
+					message
+				))
+			report.num_loaded += len(chunk)
+	return storage, report
+
+# Function to get the byte offsets of the sections of a snapshot
+# Arguments:
+#	num_rows: number of table rows
+#	num_fields: number of parameters
+#	num_messages: number of unique messages
+# Return values:
+#	layout: dict of section name to byte offset. Each section starts 8 byte aligned
+def getSnapshotLayout(num_rows, num_fields, num_messages):
+	sizes = [
+		('header', SNAPSHOT_HEADER.size),
+		('limits', 3*num_rows*num_fields),
+		('base_weights', 4*num_rows),
+		('message_ids', 4*num_rows),
+		('offsets', 8*(num_messages + 1)),
+		('blob', 0)
+	]
+	layout = {}
+	offset = 0
+	for name, size in sizes:
+		layout[name] = offset
+		offset = -(-(offset + size) // 8) * 8
+	return layout
+
+# Function to read the header of a snapshot
+# Arguments:
+#	buffer: buffer holding a snapshot
+# Return values:
+#	header: dict of snapshot header fields
+def readSnapshotHeader(buffer):
+	if (len(buffer) < SNAPSHOT_HEADER.size):
+		raise ValueError('Snapshot is too short')
+	fields = SNAPSHOT_HEADER.unpack_from(buffer, 0)
+	header = dict(zip(['magic', 'version', 'num_fields', 'num_rows', 'num_messages', 'blob_size', \
+		'source_size', 'source_mtime_ns', 'source_hash'], fields))
+	if (header['magic'] != SNAPSHOT_MAGIC):
+		raise ValueError('Not a DecisionMaker snapshot')
+	if (header['num_fields'] != len(Parameter_Fields)):
+		raise ValueError('Snapshot has {} parameters, expected {}'.format(header['num_fields'], len(Parameter_Fields)))
+	return header
+
+# Function to hash a file
+# Arguments:
+#	fname: name of file
+# Return values:
+#	digest: sha256 digest of file contents
+def hashFile(fname):
+	digest = hashlib.sha256()
+	with open(fname, 'rb') as fptr:
+		for chunk in iter(lambda: fptr.read(1 << 20), b''):
+			digest.update(chunk)
+	return digest.digest()
+
+# Function to lay out a PossibilityTable as a snapshot. Layout, all little endian:
+#	header: SNAPSHOT_HEADER, holding counts and the size, mtime and sha256 of the source file
+#	limits: int8 matrix of shape (3, N, len(Parameter_Fields)). Min limits, max limits, param weights
+#	base_weights: N int32
+#	message_ids: N int32, index of each row's message
+#	offsets: M + 1 uint64, where each of M messages starts in blob
+#	blob: all messages utf-8 encoded back to back
+# Arguments:
+#	table: PossibilityTable to write
+#	source_fname: name of file the table was loaded from, used to detect stale snapshots
+# Return values:
+#	size: size of the snapshot in bytes
+#	sections: list of (offset, data) pairs. Gaps between sections are zero padding
+def packSnapshot(table, source_fname=None):
+	n = table.size
+	blob, offsets = table.messages.encode()
+	source_size, source_mtime_ns, source_hash = 0, 0, bytes(32)
+	if (source_fname is not None):
+		stat = os.stat(source_fname)
+		source_size, source_mtime_ns, source_hash = stat.st_size, stat.st_mtime_ns, hashFile(source_fname)
+	header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, 1, len(Parameter_Fields), n, len(offsets) - 1, len(blob), \
+		source_size, source_mtime_ns, source_hash)
+	layout = getSnapshotLayout(n, len(Parameter_Fields), len(offsets) - 1)
+
+	sections = [
+		('header', header),
+		('limits', np.stack([table.min_limits[:n], table.max_limits[:n], table.param_weights[:n]]).astype(np.int8)),
+		('base_weights', table.base_weights[:n].astype('<i4')),
+		('message_ids', table.message_ids[:n].astype('<i4')),
+		('offsets', offsets.astype('<u8')),
+		('blob', blob)
+	]
+	sections = [(layout[name], data if isinstance(data, bytes) else data.tobytes()) for name, data in sections]
+	return layout['blob'] + len(blob), sections
+
+# Function to write a PossibilityTable to a snapshot file, see packSnapshot.
+#	The file is written next to its final name and moved into place, so readers never see half of it
+# Arguments:
+#	table: PossibilityTable to write
+#	snap_fname: name of snapshot file
+#	source_fname: name of file the table was loaded from, used to detect stale snapshots
+def writeSnapshot(table, snap_fname, source_fname=None):
+	size, sections = packSnapshot(table, source_fname)
+	tmp_fname = snap_fname + '.tmp'
+	with open(tmp_fname, 'wb') as fptr:
+		for offset, data in sections:
+			fptr.write(bytes(offset - fptr.tell()))
+			fptr.write(data)
+	os.replace(tmp_fname, snap_fname)
+
+# Function to open a snapshot file as a PossibilityTable. The file is memory mapped, and the
+#	table's arrays point straight into it
+# Arguments:
+#	snap_fname: name of snapshot file
+# Return values:
+#	table: PossibilityTable
+#	header: dict of snapshot header fields
+def openSnapshot(snap_fname):
+	with open(snap_fname, 'rb') as fptr:
+		buffer = mmap.mmap(fptr.fileno(), 0, access=mmap.ACCESS_READ)
+	table = PossibilityTable(capacity=0)
+	header = table.loadBuffer(buffer)
+	return table, header
+
+# Function to check if a snapshot was written from the current version of its source file
+# Arguments:
+#	snap_fname: name of snapshot file
+#	source_fname: name of source file
+# Return values:
+#	fresh: true if the snapshot exists and the source hasn't changed since it was written
+def isSnapshotFresh(snap_fname, source_fname):
+	if not os.path.exists(snap_fname):
+		return False
+	try:
+		with open(snap_fname, 'rb') as fptr:
+			header = readSnapshotHeader(fptr.read(SNAPSHOT_HEADER.size))
+	except ValueError:
+		return False
+
+	# Same size and mtime is fresh. Otherwise, the contents may still be the same
+	stat = os.stat(source_fname)
+	if (stat.st_size == header['source_size']) and (stat.st_mtime_ns == header['source_mtime_ns']):
+		return True
+	return (stat.st_size == header['source_size']) and (hashFile(source_fname) == header['source_hash'])
+
+# Function to convert a database file into a snapshot file
+# Arguments:
+#	db_fname: name of database file
+#	snap_fname: name of snapshot file. Defaults to db_fname + SNAPSHOT_EXT
+# Return values:
+#	snap_fname: name of snapshot file
+def compileSnapshot(db_fname, snap_fname=None):
+	if (snap_fname is None):
+		snap_fname = db_fname + SNAPSHOT_EXT
+	database = PossibilityDatabase(db_fname, backend='numpy', cache_bytes=0)
+	writeSnapshot(database.table, snap_fname, db_fname)
+	return snap_fname
+
+# PossibilityDatabase object
+# Everything loaded from a database file: the Possibilities, and the index and candidate cache built over them.
+# DecisionMaker swaps in a whole new PossibilityDatabase when the file is reloaded, so a decision
+#	never sees a mix of old and new Possibilities.
+class PossibilityDatabase:
+	# PossibilityDatabase class constructor. Loads the database file
+	# Arguments:
+	#	db_fname, backend, cache_bytes, sampler, snapshot, scoring, buffer, metrics: see DecisionMaker
+	def __init__(self, db_fname, backend=DEFAULT_BACKEND, cache_bytes=DEFAULT_CACHE_BYTES, sampler='prefix', \
+		snapshot=False, scoring='base', buffer=None, metrics=None):
 		# Save database filename
 		self.db_fname = db_fname
+		self.metrics = metrics
 
 		# Start with an empty list of Possibilities
-		self.possibilities = []
+		if (backend not in BACKENDS):
+			raise ValueError('Unknown backend {}, must be one of {}'.format(backend, BACKENDS))
+		self.backend = backend
+		if (sampler not in SAMPLERS):
+			raise ValueError('Unknown sampler {}, must be one of {}'.format(sampler, SAMPLERS))
+		self.sampler = sampler
+		if (scoring not in SCORING_MODES):
+			raise ValueError('Unknown scoring mode {}, must be one of {}'.format(scoring, SCORING_MODES))
+		self.scoring = scoring
+		# Rows of all Possibilities with each message, only needed for the python backend
+		self.messageRows = collections.defaultdict(list)
+		if (backend == 'numpy'):
+			# Possibilities are stored in the table, and only made into objects when accessed
+			self.table = PossibilityTable()
+			self.possibilities = PossibilityList(self.table)
+		else:
+			self.table = None
+			self.possibilities = []
+		self.index = None
+		self.cache = CandidateCache(cache_bytes) if (cache_bytes > 0) else None
+
+		# Counts and reasons of skipped and rejected database lines
+		self.loadReport = LoadReport()
+
+		# Add all possibilities from database file, or its snapshot
+		if not isinstance(db_fname, str):
+			snap_fname = None
+			if (snapshot):
+				raise ValueError('Snapshots can\'t be kept for shard files')
+		elif db_fname.endswith(SNAPSHOT_EXT):
+			snap_fname = db_fname
+		else:
+			snap_fname = db_fname + SNAPSHOT_EXT
+		if (snapshot or (snap_fname == db_fname) or (buffer is not None)) and (backend != 'numpy'):
+			raise ValueError('Snapshots need the numpy backend')
+		if (buffer is not None):
+			self.table = PossibilityTable(capacity=0)
+			self.table.loadBuffer(buffer)
+			self.possibilities = PossibilityList(self.table)
+		elif (snap_fname == db_fname) or (snapshot and isSnapshotFresh(snap_fname, db_fname)):
+			self.table = openSnapshot(snap_fname)[0]
+			self.possibilities = PossibilityList(self.table)
+		else:
+			self.readDatabase(db_fname)
+			if (snapshot):
+				writeSnapshot(self.table, snap_fname, db_fname)
+
+		# Index the loaded table. Kept up to date by addPossibility from now on
+		if (self.table is not None):
+			self.index = PossibilityIndex(self.table)
+
+	# Function to add Possibility to internal list
+	def addPossibility(self, possibility):
+		if (self.table is not None):
+			self.table.addPossibility(possibility)
+		else:
+			self.possibilities.append(possibility)
+			self.messageRows[possibility.getMsg()].append(len(self.possibilities) - 1)
+		if (self.index is not None):
+			self.index.addRow(self.table.size - 1)
+		if (self.cache is not None):
+			self.cache.clear()
+
+	# Function to read in possibilities from database file and populate list.
+	#	Files are parsed in chunks, and skipped and rejected lines are counted in self.loadReport
+	# Arguments:
+	#	db_fname: name of file to read in Possibility data from, or a list of shard files
+	def readDatabase(self, db_fname):
+		fnames = [db_fname] if isinstance(db_fname, str) else list(db_fname)
+
+		# A single file is appended straight into the table
+		if (len(fnames) == 1):
+			storage, report = loadDatabase(fnames[0], self.backend, self.loadReport.max_rejects, self.table)
+			self.addLoaded(None if (self.table is not None) else storage, report)
+		else:
+			# Shards are parsed in parallel, then appended in order as each one arrives, so that shards
+			#	already appended are not held in memory too
+			num_workers = min(len(fnames), os.cpu_count() or 1)
+			with concurrent.futures.ProcessPoolExecutor(num_workers) as pool:
+				for storage, report in pool.map(loadDatabase, fnames, [self.backend]*len(fnames), \
+					[self.loadReport.max_rejects]*len(fnames)):
+					self.addLoaded(storage, report)
+
+		# Rows appended straight to the table skip addPossibility, so index them and forget cached Candidates
+		if (self.table is not None):
+			if (self.index is not None):
+				self.index.rebuild()
+			if (self.cache is not None):
+				self.cache.clear()
+
+	# Function to append the storage loaded from one file by loadDatabase, and count its skipped
+	#	and rejected lines in self.loadReport
+	# Arguments:
+	#	storage: PossibilityTable or list of Possibilities returned by loadDatabase. None if the
+	#		rows were appended straight into self.table
+	#	report: LoadReport returned by loadDatabase
+	def addLoaded(self, storage, report):
+		self.loadReport.merge(report)
+		if (storage is None):
+			return
+		if (self.table is not None):
+			self.table.addTable(storage)
+		else:
+			for possibility in storage:
+				self.addPossibility(possibility)
+
+	# Function to get the probability weights of all Possibilities under some Parameters
+	# Arguments:
+	#	params: Parameters under which weights are calculated
+	# Return values:
+	#	weights: list (python backend) or array (numpy backend) of weights, one per Possibility
+	def getWeights(self, params):
+		if (self.table is not None):
+			return self.table.getWeights(params, self.scoring)
+		return [p.getProb(params, self.scoring) for p in self.possibilities]
+
+	# Function to get the Possibilities which fit some Parameters, and their weights.
+	#	With the numpy backend only rows whose limits contain the Parameters are returned
+	# Arguments:
+	#	params: Parameters under which weights are calculated
+	#	tracker: FeasibilityTracker of self.table to find the rows with, instead of the index
+	# Return values:
+	#	candidates: Candidates fitting the Parameters
+	def getCandidates(self, params, tracker=None):
+		# Check the cache first
+		key = tuple(params)
+		if (self.cache is not None):
+			candidates = self.cache.get(key)
+			if (candidates is not None):
+				return candidates
+
+		metrics = self.metrics
+		if (metrics is not None):
+			start = time.perf_counter()
+		if (self.table is None):
+			candidates = Candidates(None, self.getWeights(params))
+		else:
+			if (tracker is not None):
+				rows = tracker.getRows(params)
+			elif (self.index is not None):
+				rows = self.index.getRows(params)
+			else:
+				rows = np.flatnonzero(self.table.inLimits(params))
+			if (metrics is not None):
+				filtered = time.perf_counter()
+				metrics.observe('filter_seconds', filtered - start)
+				start = filtered
+			candidates = Candidates(rows, self.table.getRowWeights(rows, params, self.scoring))
+
+		candidates = self.prepareCandidates(key, candidates)
+		if (metrics is not None):
+			metrics.observe('weights_seconds', time.perf_counter() - start)
+		return candidates
+
+	# Function to get the Possibilities which fit each of a batch of Parameters, and their weights
+	# Arguments:
+	#	params_batch: sequence of Parameters
+	# Return values:
+	#	candidates_batch: list with one Candidates per Parameters
+	def getCandidatesMany(self, params_batch):
+		# A single Parameters is quicker to look up on its own
+		if (self.table is None) or (len(params_batch) < 2):
+			return [self.getCandidates(params) for params in params_batch]
+
+		# Look up cached Parameters, and find and score the rest together
+		candidates_batch = [None]*len(params_batch)
+		if (self.cache is not None):
+			candidates_batch = [self.cache.get(tuple(params)) for params in params_batch]
+		missed = [i for i in range(len(params_batch)) if (candidates_batch[i] is None)]
+		if (len(missed) > 0):
+			metrics = self.metrics
+			if (metrics is not None):
+				start = time.perf_counter()
+			missed_params = [params_batch[i] for i in missed]
+			indptr, rows = self.index.getRowsMany(missed_params)
+			if (metrics is not None):
+				filtered = time.perf_counter()
+				metrics.observe('batch_filter_seconds', filtered - start)
+				start = filtered
+			weights = self.table.getRowWeightsMany(indptr, rows, missed_params, self.scoring)
+
+			# Copy each query's rows out, so cached Candidates don't keep the whole batch alive
+			for j, i in enumerate(missed):
+				part = slice(indptr[j], indptr[j + 1])
+				candidates = Candidates(rows[part].copy(), weights[part].copy())
+				candidates_batch[i] = self.prepareCandidates(tuple(params_batch[i]), candidates)
+			if (metrics is not None):
+				metrics.observe('weights_seconds', time.perf_counter() - start)
+		return candidates_batch
+
+	# Function to get newly scored Candidates ready for drawing: share them with equal cached
+	#	Candidates, build the sampler's tables and add them to the cache
+	# Arguments:
+	#	key: tuple of Parameters values the Candidates were scored under
+	#	candidates: new Candidates
+	# Return values:
+	#	candidates: Candidates to draw from
+	def prepareCandidates(self, key, candidates):
+		if (self.cache is not None):
+			candidates = self.cache.share(candidates)
+		if (self.sampler == 'alias'):
+			candidates.buildAlias()
+		if (self.cache is not None):
+			self.cache.put(key, candidates)
+		return candidates
+
+	# Function to get the probability weights of all Possibilities under a batch of Parameters
+	# Arguments:
+	#	params_batch: sequence of Parameters
+	# Return values:
+	#	weights: sequence with one getWeights result per Parameters
+	def getWeightsMany(self, params_batch):
+		if (self.table is not None):
+			return self.table.getWeightsMany(params_batch, self.scoring)
+		return [self.getWeights(params) for params in params_batch]
+
+	# Function to get the probability of each message under each of a batch of Parameters,
+	#	see DecisionMaker.distributionMany
+	# Arguments:
+	#	params_batch: sequence of Parameters
+	#	top_k: if not None, only the top_k most probable messages are kept per Parameters
+	# Return values:
+	#	distributions: Distributions
+	def getDistributionMany(self, params_batch, top_k=None):
+		candidates_batch = self.getCandidatesMany(params_batch)
+		if (self.table is None):
+			return self.getDistributionList(candidates_batch, top_k)
+
+		# Sum the weights of each message per Parameters, for as many Parameters at a time as fit
+		#	in MAX_DISTRIBUTION_SUMS sums
+		num_messages = max(len(self.table.messages), 1)
+		block_size = max(1, MAX_DISTRIBUTION_SUMS // num_messages)
+		parts = []
+		for start in range(0, len(candidates_batch), block_size):
+			block = candidates_batch[start:start + block_size]
+			rows = np.concatenate([np.zeros(0, dtype=np.int64)] + [candidates.rows for candidates in block])
+			weights = np.concatenate([np.zeros(0, dtype=np.int64)] + \
+				[np.diff(candidates.cum_weights, prepend=0) for candidates in block])
+			queries = np.repeat(np.arange(len(block)), [len(candidates.rows) for candidates in block])
+			sums = np.bincount(queries*num_messages + self.table.message_ids[rows], weights=weights, \
+				minlength=len(block)*num_messages)
+
+			# Nonzero sums come out ordered by Parameters, then message
+			keys = np.flatnonzero(sums)
+			totals = np.array([candidates.total_weight for candidates in block], dtype=np.float64)
+			parts.append((start + keys // num_messages, keys % num_messages, sums[keys] / totals[keys // num_messages]))
+		queries, message_ids, probs = [np.concatenate([np.zeros(0, dtype=dtype)] + [part[i] for part in parts]) \
+			for i, dtype in enumerate([np.int64, np.int64, np.float64])]
+
+		# With top_k, only the top_k messages of each Parameters need sorting: those more probable than
+		#	the top_k-th, then the first of those as probable as it
+		if (top_k is not None):
+			starts = np.searchsorted(queries, np.arange(len(candidates_batch) + 1))
+			thresholds = np.zeros(len(candidates_batch))
+			for i in np.flatnonzero(np.diff(starts) > top_k):
+				segment = probs[starts[i]:starts[i + 1]]
+				thresholds[i] = np.partition(segment, len(segment) - top_k)[len(segment) - top_k]
+			above = (probs > thresholds[queries])
+			tied = (probs == thresholds[queries])
+			num_above = np.bincount(queries[above], minlength=len(candidates_batch))
+			tied_before = np.concatenate([[0], np.cumsum(tied)])
+			tied_rank = tied_before[1:] - 1 - tied_before[starts[:-1]][queries]
+			keep = above | (tied & (tied_rank < top_k - num_above[queries]))
+			queries, message_ids, probs = queries[keep], message_ids[keep], probs[keep]
+
+		# Most probable first within each Parameters. Stable sorts keep ties in message order
+		order = np.argsort(-probs, kind='stable')
+		order = order[np.argsort(queries[order], kind='stable')]
+		queries, message_ids, probs = queries[order], message_ids[order], probs[order]
+		indptr = np.searchsorted(queries, np.arange(len(candidates_batch) + 1))
+
+		# Keep the top_k of each Parameters
+		if (top_k is not None):
+			keep = (np.arange(len(queries)) - indptr[queries] < top_k)
+			message_ids, probs = message_ids[keep], probs[keep]
+			indptr = np.concatenate([[0], np.cumsum(np.minimum(np.diff(indptr), top_k))])
+		return Distributions(indptr, message_ids.astype(np.int32), probs, self.table.messages)
+
+	# Function to get the probability of each message in Candidates of the python backend
+	# Arguments:
+	#	candidates_batch: list of Candidates covering all Possibilities
+	#	top_k: see getDistributionMany
+	# Return values:
+	#	distributions: Distributions of lists, message numbers in the order messages were added
+	def getDistributionList(self, candidates_batch, top_k=None):
+		messages = list(self.messageRows)
+		numbers = {message: number for number, message in enumerate(messages)}
+		indptr, message_ids, probs = [0], [], []
+		for candidates in candidates_batch:
+			sums = collections.defaultdict(int)
+			last = 0
+			for i, cum_weight in enumerate(candidates.cum_weights):
+				if (cum_weight != last):
+					sums[numbers[self.possibilities[i].getMsg()]] += cum_weight - last
+				last = cum_weight
+			entries = sorted(sums.items(), key=lambda entry: (-entry[1], entry[0]))[:top_k]
+			message_ids += [number for number, weight in entries]
+			probs += [weight / candidates.total_weight for number, weight in entries]
+			indptr.append(len(message_ids))
+		return Distributions(indptr, message_ids, probs, messages)
+
+	# Function to get the message of a Possibility
+	# Arguments:
+	#	candidates: Candidates the Possibility was chosen from
+	#	i: index of the Possibility within candidates
+	# Return values:
+	#	message: message of the Possibility
+	def getCandidateMsg(self, candidates, i):
+		if (candidates.rows is None):
+			return self.possibilities[i].getMsg()
+		return self.table.getMsg(candidates.rows[i])
+
+	# Function to find the candidates with some message
+	# Arguments:
+	#	candidates: Candidates to search
+	#	message: message to look for
+	# Return values:
+	#	indices: sorted list of indices of candidates with this message
+	def findCandidateMsg(self, candidates, message):
+		if (candidates.rows is None):
+			return self.messageRows.get(message, [])
+		rows = self.table.getMsgRows(message)
+
+		# Both lists of rows are sorted
+		positions = np.searchsorted(candidates.rows, rows)
+		return [int(i) for i, row in zip(positions, rows) \
+			if (i < len(candidates.rows)) and (candidates.rows[i] == row)]
+
+# DecisionMaker object
+# Has a database of possibility objects, and makes decisions from it.
+# The database can be shared by any number of threads. choose and chooseMany keep one last decision
+#	and use the random module, so each thread should make its decisions through its own DecisionSession
+class DecisionMaker:
+	# DecisionMaker class constructor
+	# Arguments:
+	#	db_fname: name of file to read in Possibility data from, or a list of shard files which are
+	#		loaded concurrently and appended in order. Tab separated, or a spreadsheet ending in ODS_EXT
+	#	backend: one of BACKENDS. Defaults to numpy if it is installed
+	#	cache_bytes: memory bound of the cache of Candidates per Parameters. 0 disables the cache
+	#	sampling: one of SAMPLING_MODES
+	#	sampler: one of SAMPLERS. The alias sampler builds its tables once per cached Candidates,
+	#		so it should be used with the cache enabled
+	#	snapshot: if true, keep a binary snapshot of the database next to it (db_fname + SNAPSHOT_EXT),
+	#		open that instead of parsing the database, and rewrite it when the database changes.
+	#		Database files ending in SNAPSHOT_EXT are always opened as snapshots. numpy backend only
+	#	scoring: one of SCORING_MODES
+	#	buffer: buffer holding a snapshot (see packSnapshot) to use instead of reading db_fname, e.g. shared
+	#		memory. The table points straight into it. Reloading uses the buffer again. numpy backend only
+	#	metrics: Metrics to record timings and counts of decisions in, or None to record nothing
+	def __init__(self, db_fname, backend=DEFAULT_BACKEND, cache_bytes=DEFAULT_CACHE_BYTES, sampling='rejection', \
+		sampler='prefix', snapshot=False, scoring='base', buffer=None, metrics=None):
+		if (sampling not in SAMPLING_MODES):
+			raise ValueError('Unknown sampling mode {}, must be one of {}'.format(sampling, SAMPLING_MODES))
+		self.sampling = sampling
+		self.metrics = metrics
+
+		# Load all possibilities. Options are saved for reloading
+		self.databaseOptions = {'backend': backend, 'cache_bytes': cache_bytes, 'sampler': sampler, \
+			'snapshot': snapshot, 'scoring': scoring, 'buffer': buffer, 'metrics': metrics}
+		self.database = PossibilityDatabase(db_fname, **self.databaseOptions)
 
 		# Initialize last decision tracker
 		self.lastDecision = ''
 
-		# Add all possibilities from database file
-		fptr = open(db_fname, 'r')
-		reader = csv.reader(fptr, delimiter='\t')
-		for l in reader:
-			# Ignore comment lines, empty lines and malformed lines
-			if (len(l) == 3*len(Parameter_Fields) + 2):
-				if (len(l[0]) > 0):
-					if (l[0][0] != '#'):
-						message = l[0]
-						base_weight = int(l[1])
-						min_params = Parameters(*tuple(
-							[int(i) for i in l[2:len(Parameter_Fields)+2]])
-						)
-
-						max_params = Parameters(*tuple(
-							[int(i) for i in l[len(Parameter_Fields)+2:2*len(Parameter_Fields)+2]])
-						)
-
-						param_weights = Parameters(*tuple(
-							[int(i) for i in l[2*len(Parameter_Fields)+2:]])
-						)
-
-						self.addPossibility(
-							Possibility(min_params, max_params, param_weights, base_weight, message)
-						)
+		# Last decisions of named sessions, least recently used first, see chooseMany
+		self.lastDecisions = collections.OrderedDict()
+
+		# Feasibility masks of the last Parameters chosen under, see getTracker
+		self.tracker = None
+
+		# Reload statistics and file watcher, see reload and watch
+		self.reloadStats = {
+			'reloads': 0,
+			'failures': 0,
+			'last_error': None,
+			'last_reload_seconds': 0.0,
+			'total_reload_seconds': 0.0,
+			'last_swap_seconds': 0.0,
+			'max_swap_seconds': 0.0
+		}
+		self.watcher = None
+		self.watcherStop = threading.Event()
 
 		# Seed rng
 		random.seed()
 
+	# Getters for the current database's contents
+	@property
+	def db_fname(self):
+		return self.database.db_fname
+	@property
+	def backend(self):
+		return self.database.backend
+	@property
+	def sampler(self):
+		return self.database.sampler
+	@property
+	def scoring(self):
+		return self.database.scoring
+	@property
+	def table(self):
+		return self.database.table
+	@property
+	def possibilities(self):
+		return self.database.possibilities
+	@property
+	def messageRows(self):
+		return self.database.messageRows
+	@property
+	def index(self):
+		return self.database.index
+	@property
+	def cache(self):
+		return self.database.cache
+	@property
+	def loadReport(self):
+		return self.database.loadReport
+
 	# Function to add Possibility to internal list
 	def addPossibility(self, possibility):
-		self.possibilities.append(possibility)
+		self.database.addPossibility(possibility)
 
-	# Function to read in possibilities from database file and populate list
+	# Function to read in possibilities from a database file and add them to the list
+	def readDatabase(self, db_fname):
+		self.database.readDatabase(db_fname)
+
+	# Functions to score Possibilities, see PossibilityDatabase
+	def getWeights(self, params):
+		return self.database.getWeights(params)
+	def getWeightsMany(self, params_batch):
+		return self.database.getWeightsMany(params_batch)
+	def getCandidates(self, params):
+		return self.database.getCandidates(params)
+	def getCandidatesMany(self, params_batch):
+		return self.database.getCandidatesMany(params_batch)
+
+	# Function to get the probability of each message being chosen under some Parameters, instead of
+	#	choosing one. Uses the same weights as choose, but doesn't leave out the last decision
+	# Arguments:
+	#	params: Parameters under which a Possibility would be chosen
+	#	top_k: if not None, only the top_k most probable messages are returned. Their probabilities
+	#		are not scaled up to sum to 1
+	# Return values:
+	#	distribution: list of (message, probability) pairs with nonzero probability, most probable first.
+	#		Ties are in the order messages were added. Empty if choose would answer with EIGHT_BALL
+	def distribution(self, params, top_k=None):
+		return self.distributionMany([params], top_k).getRow(0)
+
+	# Function to get the probability of each message being chosen under each of a batch of Parameters,
+	#	scored together, see distribution
+	# Arguments:
+	#	params_batch: sequence of Parameters
+	#	top_k: see distribution
+	# Return values:
+	#	distributions: Distributions with one row per Parameters
+	def distributionMany(self, params_batch, top_k=None):
+		if (top_k is not None) and (top_k < 1):
+			raise ValueError('Number of messages top_k must be at least 1, got {}'.format(top_k))
+		return self.database.getDistributionMany(params_batch, top_k)
+
+	# Function to load the database file again, and swap it in for the current one.
+	#	The new database is built first, so decisions made meanwhile use the old one.
+	#	Last decisions are kept
+	# Arguments:
+	#	None
+	# Return values:
+	#	None. Errors loading the file are raised, and the old database is kept
+	def reload(self):
+		start = time.perf_counter()
+		try:
+			database = PossibilityDatabase(self.database.db_fname, **self.databaseOptions)
+		except Exception as error:
+			self.reloadStats['failures'] += 1
+			self.reloadStats['last_error'] = repr(error)
+			raise
+		loaded = time.perf_counter()
+		if (self.metrics is not None):
+			self.metrics.observe('reload_seconds', loaded - start)
+
+		# Swapping one attribute is atomic, so every decision uses either the old or new database
+		self.database = database
+		swapped = time.perf_counter()
+
+		self.reloadStats['reloads'] += 1
+		self.reloadStats['last_error'] = None
+		self.reloadStats['last_reload_seconds'] = loaded - start
+		self.reloadStats['total_reload_seconds'] += loaded - start
+		self.reloadStats['last_swap_seconds'] = swapped - loaded
+		self.reloadStats['max_swap_seconds'] = max(self.reloadStats['max_swap_seconds'], swapped - loaded)
+
+	# Function to start a background thread which reloads the database whenever its file changes
+	# Arguments:
+	#	interval: seconds between checks of the file's size and modification time. A change is only
+	#		reloaded once the file has stayed the same for one interval, so half written files are skipped
+	def watch(self, interval=1.0):
+		if (self.watcher is not None):
+			return
+		self.watcherStop.clear()
+		self.watcher = threading.Thread(target=self.watchLoop, args=(interval,), name='DecisionMakerWatcher', \
+			daemon=True)
+		self.watcher.start()
+
+	# Function to stop the thread started by watch
+	def stopWatching(self):
+		if (self.watcher is None):
+			return
+		self.watcherStop.set()
+		self.watcher.join()
+		self.watcher = None
+
+	# Function to get the size and modification time of the database files
+	# Arguments:
+	#	None
+	# Return values:
+	#	stats: list of (size, mtime) per file, or None for missing files
+	def getDatabaseStats(self):
+		db_fname = self.database.db_fname
+		stats = []
+		for fname in ([db_fname] if isinstance(db_fname, str) else db_fname):
+			try:
+				stat = os.stat(fname)
+				stats.append((stat.st_size, stat.st_mtime_ns))
+			except OSError:
+				stats.append(None)
+		return stats
+
+	# Body of the watch thread
+	# Arguments:
+	#	interval: seconds between checks
+	def watchLoop(self, interval):
+		loaded_stats = self.getDatabaseStats()
+		last_stats = loaded_stats
+		while not self.watcherStop.wait(interval):
+			stats = self.getDatabaseStats()
+			if (stats != loaded_stats) and (stats == last_stats) and (None not in stats):
+				# Failed reloads are counted in reloadStats, and retried on the next change
+				try:
+					self.reload()
+				except Exception:
+					pass
+				loaded_stats = stats
+			last_stats = stats
+
+	# Function to get the recorded metrics, the candidate cache's statistics and the reload statistics
+	#	in the Prometheus text exposition format
+	# Arguments:
+	#	None
+	# Return values:
+	#	text: metrics, one sample per line. Only the statistics if no Metrics are recorded
+	def getPrometheusText(self):
+		gauges = {'possibilities': len(self.possibilities)}
+		if (self.cache is not None):
+			gauges.update(('cache_' + name, value) for name, value in self.cache.getStats().items())
+		gauges.update(('reload_' + name, value) for name, value in self.reloadStats.items() \
+			if (name != 'last_error'))
+		metrics = self.metrics if (self.metrics is not None) else Metrics([])
+		return metrics.getPrometheusText(gauges)
 
 	# Function which takes some Parameters and finds all Possibilities which fit.
 	#	Then it randomly chooses from that list based on weights,
@@ -183,26 +2265,198 @@ class DecisionMaker:
 	# Return values:
 	#	message: string representing the correct decision to be made under these Parameters
 	def choose(self, params):
-		decision = self.lastDecision
-		# Prevent getting the same message twice in a row
-		while (decision == self.lastDecision):
+		# Make decision, avoiding a repeat of the last one
+		database = self.database
+		decision = self.makeDecision(database.getCandidates(params, self.getTracker(database)), \
+			self.lastDecision, database)
+
+		# Set last decision
+		self.lastDecision = decision
+
+		# Return decision
+		return decision
+
+	# Function to filter and score the Possibilities under some Parameters ahead of time, e.g. while
+	#	the user is still choosing them. A later choose under the same Parameters finds the scored
+	#	Candidates in the cache, and only has to draw. Does nothing useful if the cache is disabled
+	# Arguments:
+	#	params: Parameters a decision is likely to be made under
+	# Return values:
+	#	None
+	def prepare(self, params):
+		database = self.database
+		database.getCandidates(params, self.getTracker(database))
+
+	# Function to get the FeasibilityTracker used by choose and prepare, which usually get Parameters
+	#	differing in one field from the last ones. Made again when the database is reloaded
+	# Arguments:
+	#	database: PossibilityDatabase being chosen from
+	# Return values:
+	#	tracker: FeasibilityTracker of the database's table, or None for the python backend
+	def getTracker(self, database):
+		if (database.table is None):
+			return None
+		tracker = self.tracker
+		if (tracker is None) or (tracker.table is not database.table):
+			tracker = self.tracker = FeasibilityTracker(database.table)
+		return tracker
+
+	# Function to start a new session sharing this DecisionMaker's database
+	# Arguments:
+	#	seed: seed of the session's random number generator. None seeds it from the OS
+	# Return values:
+	#	session: DecisionSession
+	def session(self, seed=None):
+		return DecisionSession(self, seed)
+
+	# Function which makes decisions for a stream of Parameters, scoring them in batches.
+	#	Gives the same decisions as calling choose on each Parameters in turn, but computes
+	#	the weights for up to k Parameters in one pass. Decisions are yielded lazily
+	# Arguments:
+	#	params_iterable: iterable (list, generator, ...) of Parameters
+	#	k: maximum number of Parameters scored together in one pass
+	#	session: key of the session these decisions belong to. Each session has its own
+	#		last decision which is never repeated. None uses the same last decision as choose.
+	#		Only the MAX_SESSION_DECISIONS most recently used sessions are remembered
+	# Return values:
+	#	generator yielding one decision message per Parameters
+	def chooseMany(self, params_iterable, k=32, session=None):
+		if (k < 1):
+			raise ValueError('Batch size k must be at least 1, got {}'.format(k))
+
+		params_iter = iter(params_iterable)
+		while True:
+			# Score the next batch
+			params_batch = list(itertools.islice(params_iter, k))
+			if (len(params_batch) == 0):
+				return
+			database = self.database
+			candidates_batch = database.getCandidatesMany(params_batch)
+
+			# Make decisions one at a time, so that each one sees the previous one
+			for candidates in candidates_batch:
+				if (session is None):
+					decision = self.makeDecision(candidates, self.lastDecision, database)
+					self.lastDecision = decision
+				else:
+					decision = self.makeDecision(candidates, self.lastDecisions.get(session, ''), database)
+					self.lastDecisions[session] = decision
+					self.lastDecisions.move_to_end(session)
+					if (len(self.lastDecisions) > MAX_SESSION_DECISIONS):
+						self.lastDecisions.popitem(last=False)
+				yield decision
+
+	# Function which randomly chooses a Possibility based on weights,
+	#	without choosing the same message twice in a row
+	# Arguments:
+	#	candidates: Candidates to choose from, as returned by getCandidates
+	#	last_decision: message which should not be chosen again, if there is any alternative
+	#	database: PossibilityDatabase the candidates are from. Defaults to the current one
+	#	rng: random number generator, e.g. a random.Random. Defaults to the random module
+	# Return values:
+	#	message: message of the chosen Possibility, or an EIGHT_BALL message if all weights are 0
+	def makeDecision(self, candidates, last_decision, database=None, rng=random):
+		if (database is None):
+			database = self.database
+		metrics = self.metrics
+		if (metrics is None):
+			return self.drawDecision(candidates, last_decision, database, rng)[0]
 
-			# Get all possibility weights
-			weights = [p.getProb(params) for p in self.possibilities]
+		start = time.perf_counter()
+		decision, num_draws = self.drawDecision(candidates, last_decision, database, rng)
+		metrics.observe('sample_seconds', time.perf_counter() - start)
+		metrics.observe('candidates', candidates.num_nonzero)
+		metrics.increment('decisions_total')
+		if (num_draws == 0):
+			metrics.increment('eight_ball_total')
+		elif (num_draws > 1):
+			metrics.increment('retries_total', num_draws - 1)
+		metrics.observe('retries', max(num_draws - 1, 0))
+		return decision
+
+	# Body of makeDecision
+	# Arguments:
+	#	candidates, last_decision, database, rng: see makeDecision
+	# Return values:
+	#	message: see makeDecision
+	#	num_draws: number of random draws from the candidates. 0 for an EIGHT_BALL message
+	def drawDecision(self, candidates, last_decision, database, rng):
+		# Handle the no possibilities case
+		if (candidates.total_weight == 0):
+			return rng.choice(EIGHT_BALL), 0
 
-			# Handle the no possibilities case
-			if (sum(weights) == 0):
-				return random.choice(EIGHT_BALL)
+		if (self.sampling == 'exclude'):
+			# Draw once from everything but the last decision. If nothing else is left, repeat it
+			i = candidates.draw(rng) if (candidates.num_nonzero <= 1) else \
+				candidates.drawExcluding(database.findCandidateMsg(candidates, last_decision), rng)
+			return (last_decision if (i is None) else database.getCandidateMsg(candidates, i)), 1
+
+		decision = last_decision
+		num_draws = 0
+		# Prevent getting the same message twice in a row. Weights don't change between retries
+		while (decision == last_decision):
 
 			# Get weighted random choice
-			decision = (random.choices(self.possibilities, weights)[0]).getMsg()
+			decision = database.getCandidateMsg(candidates, candidates.draw(rng))
+			num_draws += 1
 
 			# Avoid getting trapped in the 'only one possiblity' case
-			if (len([w for w in weights if w != 0]) <= 1):
+			if (candidates.num_nonzero <= 1):
 				break
 
-		# Set last decision
-		self.lastDecision = decision
+		return decision, num_draws
 
-		# Return decision
+# DecisionSession object
+# Per-session decision state: the last decision and a random number generator.
+# Sessions are cheap to make, and share their DecisionMaker's database. Each one should only be
+#	used by one thread at a time, but any number of sessions can make decisions concurrently
+class DecisionSession:
+
+	# DecisionSession class constructor
+	# Arguments:
+	#	decision_maker: DecisionMaker whose database and sampling mode are used
+	#	seed: seed of the random number generator. None seeds it from the OS
+	def __init__(self, decision_maker, seed=None):
+		self.decisionMaker = decision_maker
+		self.rng = random.Random(seed)
+		self.lastDecision = ''
+
+	# Function which chooses a Possibility's message under some Parameters, see DecisionMaker.choose
+	# Arguments:
+	#	params: Parameters under which a Possibility is being chosen
+	# Return values:
+	#	message: string representing the correct decision to be made under these Parameters
+	def choose(self, params):
+		database = self.decisionMaker.database
+		return self.makeDecision(database.getCandidates(params), database)
+
+	# Function which makes decisions for a stream of Parameters, see DecisionMaker.chooseMany
+	# Arguments:
+	#	params_iterable: iterable (list, generator, ...) of Parameters
+	#	k: maximum number of Parameters scored together in one pass
+	# Return values:
+	#	generator yielding one decision message per Parameters
+	def chooseMany(self, params_iterable, k=32):
+		if (k < 1):
+			raise ValueError('Batch size k must be at least 1, got {}'.format(k))
+
+		params_iter = iter(params_iterable)
+		while True:
+			params_batch = list(itertools.islice(params_iter, k))
+			if (len(params_batch) == 0):
+				return
+			database = self.decisionMaker.database
+			for candidates in database.getCandidatesMany(params_batch):
+				yield self.makeDecision(candidates, database)
+
+	# Function which chooses from some Candidates with this session's random number generator,
+	#	without repeating its last decision
+	# Arguments:
+	#	candidates: Candidates to choose from, as returned by getCandidates
+	#	database: PossibilityDatabase the candidates are from
+	# Return values:
+	#	message: message of the chosen Possibility
+	def makeDecision(self, candidates, database):
+		decision = self.decisionMaker.makeDecision(candidates, self.lastDecision, database, self.rng)
+		self.lastDecision = decision
 		return decision
@@ -0,0 +1,260 @@
+#
+#    ___          _     _            __  ___     __          	 /\_______/\
+#   / _ \___ ____(_)__ (_)__  ___   /  |/  /__ _/ /_____ ____ 	 /_  ___   \
+#  / // / -_) __/ (_-</ / _ \/ _ \ / /|_/ / _ `/  '_/ -_) __/	/ @\/ @ \   \
+# /____/\__/\__/_/___/_/\___/_//_//_/  /_/\_,_/_/\_\\__/_/   	\__/\___/   /
+#																 \_\/______/
+#  DecisionPool.py  											 /     /\\\\\ 
+#  Dylan Everingham for Marissa Kohan							|      \\\\\\\ 
+#																 \      \\\\\\\ 
+#																  \______/\\\\\
+#																	_||_||_
+
+
+#
+# Multiprocess decision pool for DecisionMaker app backend
+# The database is loaded once and copied into shared memory as a snapshot. Worker processes
+#	attach to it without parsing or copying it, and answer decision requests from queues
+
+# Dependencies
+import time
+import queue
+import threading
+import itertools
+import collections
+import concurrent.futures
+import multiprocessing
+import multiprocessing.shared_memory
+from DecisionMaker import *
+
+# Constants
+
+# Seconds to wait for a worker to exit when closing the pool, before it's terminated
+WORKER_JOIN_TIMEOUT = 5.0
+
+# Seconds between checks for workers which died, e.g. killed by the OOM killer, while no results came back
+WORKER_CHECK_INTERVAL = 0.5
+
+# Body of a worker process. Answers requests from its queue until it gets None
+# Arguments:
+#	shm: SharedMemory holding the database snapshot
+#	db_fname: name of the database file, only kept for reference
+#	options: DecisionMaker keyword arguments
+#	seed: seed of each session's random number generator, see DecisionPool
+#	requests: queue of (request_id, session, params_batch) requests
+#	results: queue of (request_id, decisions, error) results
+# Only the MAX_SESSION_DECISIONS most recently used sessions are kept. A forgotten session starts
+#	again from its seed, and may repeat its last decision
+def workerLoop(shm, db_fname, options, seed, requests, results):
+	decision_maker = DecisionMaker(db_fname, buffer=shm.buf, **options)
+	sessions = collections.OrderedDict()
+	for request_id, session, params_batch in iter(requests.get, None):
+		try:
+			if (session not in sessions):
+				sessions[session] = decision_maker.session(None if (seed is None) else '{}/{!r}'.format(seed, session))
+				if (len(sessions) > MAX_SESSION_DECISIONS):
+					sessions.popitem(last=False)
+			else:
+				sessions.move_to_end(session)
+			decisions = list(sessions[session].chooseMany([Parameters(*params) for params in params_batch]))
+			results.put((request_id, decisions, None))
+		except Exception as error:
+			results.put((request_id, None, error))
+
+# DecisionPool object
+# Pool of worker processes making decisions from one database in shared memory.
+# Requests of a session always go to the same worker, which keeps that session's last decision.
+#	Requests without a session go to the workers in turn, and only avoid repeats within each worker
+# If a worker dies, its requests in flight and any later requests of its sessions fail with RuntimeError
+# Safe to use from any number of threads
+class DecisionPool:
+
+	# DecisionPool class constructor. Loads the database, and starts the workers
+	# Arguments:
+	#	db_fname: name of file to read in Possibility data from, see DecisionMaker
+	#	num_workers: number of worker processes. Defaults to the number of CPUs
+	#	seed: if not None, each session's random number generator is seeded from this and the
+	#		session key, so decisions are repeatable. None seeds them from the OS
+	#	options: other DecisionMaker keyword arguments (sampling, cache_bytes, sampler, snapshot, scoring).
+	#		The backend is always numpy. cache_bytes is per worker
+	def __init__(self, db_fname, num_workers=None, seed=None, **options):
+		if (num_workers is None):
+			num_workers = multiprocessing.cpu_count()
+		if (num_workers < 1):
+			raise ValueError('Number of workers must be at least 1, got {}'.format(num_workers))
+		self.db_fname = db_fname
+		options = dict(options, backend='numpy')
+
+		# Load the database once, and copy its snapshot into shared memory
+		database = PossibilityDatabase(db_fname, backend='numpy', cache_bytes=0, \
+			snapshot=options.pop('snapshot', False), scoring=options.get('scoring', 'base'))
+		self.loadReport = database.loadReport
+		size, sections = packSnapshot(database.table)
+		del database
+		self.shm = multiprocessing.shared_memory.SharedMemory(create=True, size=size)
+		for offset, data in sections:
+			self.shm.buf[offset:offset + len(data)] = data
+
+		# Start the workers, each with its own request queue
+		self.results = multiprocessing.Queue()
+		self.requests = []
+		self.workers = []
+		for i in range(num_workers):
+			requests = multiprocessing.Queue()
+			worker = multiprocessing.Process(target=workerLoop, name='DecisionPoolWorker-{}'.format(i), \
+				args=(self.shm, db_fname, options, seed, requests, self.results), daemon=True)
+			worker.start()
+			self.requests.append(requests)
+			self.workers.append(worker)
+
+		# Futures of requests in flight and the workers they were sent to, resolved by the collector thread
+		self.pending = {}
+		self.deadWorkers = set()
+		self.closing = False
+		self.lock = threading.Lock()
+		self.requestIds = itertools.count()
+		self.nextWorker = itertools.count()
+		self.collector = threading.Thread(target=self.collectLoop, name='DecisionPoolCollector', daemon=True)
+		self.collector.start()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+	# Function to get the worker which handles a session. Requests without a session skip dead workers
+	# Arguments:
+	#	session: session key, or None
+	# Return values:
+	#	worker: index of worker. Raises RuntimeError if that worker has died
+	def getWorker(self, session):
+		if (session is None):
+			alive = [i for i in range(len(self.workers)) if (i not in self.deadWorkers)]
+			worker = alive[next(self.nextWorker) % len(alive)] if (len(alive) > 0) else 0
+		else:
+			worker = hash(session) % len(self.workers)
+		if (worker in self.deadWorkers):
+			raise RuntimeError('DecisionPool worker {} died with exit code {}'.format(worker, \
+				self.workers[worker].exitcode))
+		return worker
+
+	# Function to send a batch of Parameters to a worker
+	# Arguments:
+	#	params_batch: sequence of Parameters
+	#	session: key of the session these decisions belong to, see DecisionMaker.chooseMany
+	# Return values:
+	#	future: concurrent.futures.Future resolving to the list of decisions
+	def submit(self, params_batch, session=None):
+		future = concurrent.futures.Future()
+		with self.lock:
+			if (self.shm is None):
+				raise RuntimeError('DecisionPool is closed')
+			worker = self.getWorker(session)
+			request_id = next(self.requestIds)
+			self.pending[request_id] = (future, worker)
+			self.requests[worker].put((request_id, session, [tuple(p) for p in params_batch]))
+		return future
+
+	# Function which chooses a Possibility's message under some Parameters, see DecisionMaker.choose
+	# Arguments:
+	#	params: Parameters under which a Possibility is being chosen
+	#	session: session key, see submit
+	# Return values:
+	#	message: string representing the correct decision to be made under these Parameters
+	def choose(self, params, session=None):
+		return self.submit([params], session).result()[0]
+
+	# Function which makes decisions for a batch of Parameters in one request
+	# Arguments:
+	#	params_batch: sequence of Parameters
+	#	session: session key, see submit
+	# Return values:
+	#	decisions: list of one decision message per Parameters
+	def chooseMany(self, params_batch, session=None):
+		return self.submit(params_batch, session).result()
+
+	# Body of the collector thread. Resolves futures as results come back from the workers, and
+	#	checks for dead workers every WORKER_CHECK_INTERVAL
+	def collectLoop(self):
+		next_check = time.monotonic() + WORKER_CHECK_INTERVAL
+		while True:
+			try:
+				result = self.results.get(timeout=WORKER_CHECK_INTERVAL)
+			except queue.Empty:
+				result = ()
+			if (result is None):
+				return
+			if (len(result) > 0):
+				self.resolve(*result)
+			if (time.monotonic() >= next_check):
+				next_check = time.monotonic() + WORKER_CHECK_INTERVAL
+				self.checkWorkers()
+
+	# Function to resolve the future of a request
+	# Arguments:
+	#	request_id: id of the request
+	#	decisions: list of decisions, or None if there was an error
+	#	error: exception raised by the worker, or None
+	def resolve(self, request_id, decisions, error):
+		with self.lock:
+			entry = self.pending.pop(request_id, None)
+		if (entry is None):
+			return
+		future = entry[0]
+		if (error is not None):
+			future.set_exception(error)
+		else:
+			future.set_result(decisions)
+
+	# Function to fail the requests in flight of workers which died. Later requests of their sessions
+	#	fail in submit. Runs on the collector thread
+	def checkWorkers(self):
+		with self.lock:
+			if (self.closing):
+				return
+			dead = [i for i, worker in enumerate(self.workers) if (i not in self.deadWorkers) and \
+				not worker.is_alive()]
+		if (len(dead) == 0):
+			return
+
+		# Results a worker sent before it died are already in the queue
+		while True:
+			try:
+				self.resolve(*self.results.get_nowait())
+			except queue.Empty:
+				break
+
+		with self.lock:
+			self.deadWorkers.update(dead)
+			failed = [(request_id, future, worker) for request_id, (future, worker) in self.pending.items() \
+				if (worker in dead)]
+			for request_id, future, worker in failed:
+				del self.pending[request_id]
+		for request_id, future, worker in failed:
+			future.set_exception(RuntimeError('DecisionPool worker {} died with exit code {}'.format(worker, \
+				self.workers[worker].exitcode)))
+
+	# Function to stop the workers and free the shared memory. Requests in flight are answered first
+	def close(self):
+		with self.lock:
+			if (self.shm is None):
+				return
+			self.closing = True
+			for requests in self.requests:
+				requests.put(None)
+		for worker in self.workers:
+			worker.join(WORKER_JOIN_TIMEOUT)
+			if worker.is_alive():
+				worker.terminate()
+		self.results.put(None)
+		self.collector.join()
+
+		# Fail anything a terminated worker never answered
+		with self.lock:
+			for future, worker in self.pending.values():
+				future.set_exception(RuntimeError('DecisionPool closed before answering'))
+			self.pending.clear()
+			self.shm.close()
+			self.shm.unlink()
+			self.shm = None
@@ -0,0 +1,157 @@
+#
+#    ___          _     _            __  ___     __          	 /\_______/\
+#   / _ \___ ____(_)__ (_)__  ___   /  |/  /__ _/ /_____ ____ 	 /_  ___   \
+#  / // / -_) __/ (_-</ / _ \/ _ \ / /|_/ / _ `/  '_/ -_) __/	/ @\/ @ \   \
+# /____/\__/\__/_/___/_/\___/_//_//_/  /_/\_,_/_/\_\\__/_/   	\__/\___/   /
+#																 \_\/______/
+#  DecisionSamplingCheck.py										 /     /\\\\\ 
+#  Dylan Everingham for Marissa Kohan							|      \\\\\\\ 
+#																 \      \\\\\\\ 
+#																  \______/\\\\\
+#																	_||_||_
+
+
+#
+# Statistical check that the exclude sampling mode draws from the same distribution as rejection sampling
+# For each of a set of queries, the most probable message is taken as the last decision, and many
+#	decisions are drawn with each sampling mode from the same Candidates. A chi-square test of
+#	homogeneity compares the counts of each message. All random numbers are seeded, so runs repeat
+# Run with: python DecisionSamplingCheck.py [--rows N] [--queries N] [--draws N] [--seed S]
+
+# Dependencies
+import os
+import sys
+import math
+import random
+import argparse
+import tempfile
+import collections
+from DecisionMaker import *
+from DecisionBenchmark import getDatabase, makeQueries
+
+# Constants
+DEFAULT_ROWS = 1000
+DEFAULT_QUERIES = 20
+DEFAULT_DRAWS = 20000
+
+# Significance level of the whole check. Each query is tested at DEFAULT_ALPHA / number of queries
+DEFAULT_ALPHA = 0.001
+
+# Messages expected fewer times than this in the pooled counts are merged into one category,
+#	so that the chi-square approximation holds
+MIN_EXPECTED = 10
+
+# Function to get the probability of a chi-square statistic at least as large as some value,
+#	using the Wilson-Hilferty normal approximation
+# Arguments:
+#	statistic: chi-square statistic
+#	dof: degrees of freedom
+# Return values:
+#	p_value: upper tail probability
+def chiSquarePValue(statistic, dof):
+	if (dof < 1):
+		return 1.0
+	z = ((statistic / dof)**(1/3) - (1 - 2 / (9*dof))) / math.sqrt(2 / (9*dof))
+	return 0.5*math.erfc(z / math.sqrt(2))
+
+# Function to compare two sets of counts with a chi-square test of homogeneity
+# Arguments:
+#	counts_a, counts_b: dicts of count by category
+# Return values:
+#	statistic: chi-square statistic
+#	dof: degrees of freedom
+def chiSquareHomogeneity(counts_a, counts_b):
+	total_a = sum(counts_a.values())
+	total_b = sum(counts_b.values())
+	total = total_a + total_b
+
+	# Merge rare categories
+	pooled = collections.Counter(counts_a) + collections.Counter(counts_b)
+	rare = [key for key, count in pooled.items() if (count < MIN_EXPECTED)]
+	columns = [(counts_a.get(key, 0), counts_b.get(key, 0)) for key in pooled if (key not in rare)]
+	if (len(rare) > 0):
+		columns.append((sum(counts_a.get(key, 0) for key in rare), sum(counts_b.get(key, 0) for key in rare)))
+
+	statistic = 0.0
+	for count_a, count_b in columns:
+		expected_a = total_a*(count_a + count_b) / total
+		expected_b = total_b*(count_a + count_b) / total
+		statistic += (count_a - expected_a)**2 / expected_a + (count_b - expected_b)**2 / expected_b
+	return statistic, len(columns) - 1
+
+# Function to draw decisions for one query with one sampling mode
+# Arguments:
+#	decision_maker: DecisionMaker with the sampling mode
+#	params: Parameters
+#	last_decision: message which should not be chosen again
+#	num_draws: number of decisions
+#	seed: seed of the random number generator
+# Return values:
+#	counts: dict of number of times each message was chosen
+def drawCounts(decision_maker, params, last_decision, num_draws, seed):
+	database = decision_maker.database
+	candidates = database.getCandidates(params)
+	rng = random.Random(seed)
+	return collections.Counter(decision_maker.makeDecision(candidates, last_decision, database, rng) \
+		for i in range(num_draws))
+
+# Function to run the check
+# Arguments:
+#	db_fname: name of database file
+#	num_queries: number of queries with at least three possible messages to test
+#	num_draws: number of decisions drawn per query and sampling mode
+#	seed: random seed of the queries and draws
+#	alpha: significance level of the whole check
+#	options: other DecisionMaker keyword arguments
+# Return values:
+#	results: list of (params, statistic, dof, p_value) per query
+#	passed: true if no query's p value is below alpha / num_queries
+def runCheck(db_fname, num_queries=DEFAULT_QUERIES, num_draws=DEFAULT_DRAWS, seed=0, alpha=DEFAULT_ALPHA, \
+	**options):
+	decision_makers = {sampling: DecisionMaker(db_fname, sampling=sampling, **options) \
+		for sampling in SAMPLING_MODES}
+	reference = decision_makers['rejection']
+
+	# Only queries where avoiding the last decision leaves a choice between several messages are useful
+	queries = []
+	for params in makeQueries(reference, 50*num_queries, seed):
+		distribution = reference.distribution(params)
+		if (len(distribution) >= 3):
+			queries.append((params, distribution[0][0]))
+		if (len(queries) == num_queries):
+			break
+
+	results = []
+	for i, (params, last_decision) in enumerate(queries):
+		counts = [drawCounts(decision_makers[sampling], params, last_decision, num_draws, \
+			'{}/{}/{}'.format(seed, i, sampling)) for sampling in SAMPLING_MODES]
+		statistic, dof = chiSquareHomogeneity(*counts)
+		results.append((params, statistic, dof, chiSquarePValue(statistic, dof)))
+	passed = all((p_value >= alpha / max(len(results), 1)) for params, statistic, dof, p_value in results)
+	return results, passed
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Check that exclude sampling matches rejection sampling')
+	parser.add_argument('--db', default=None, help='database file. Defaults to a synthetic database')
+	parser.add_argument('--rows', type=int, default=DEFAULT_ROWS, help='rows of the synthetic database')
+	parser.add_argument('--queries', type=int, default=DEFAULT_QUERIES)
+	parser.add_argument('--draws', type=int, default=DEFAULT_DRAWS, help='decisions per query and sampling mode')
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('--alpha', type=float, default=DEFAULT_ALPHA, help='significance level of the whole check')
+	parser.add_argument('--backend', choices=BACKENDS, default=DEFAULT_BACKEND)
+	parser.add_argument('--sampler', choices=SAMPLERS, default='prefix')
+	parser.add_argument('--scoring', choices=SCORING_MODES, default='base')
+	parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'DecisionBenchmark'), \
+		help='directory synthetic databases are kept in')
+	args = parser.parse_args()
+
+	db_fname = args.db if (args.db is not None) else getDatabase(args.data_dir, args.rows, args.seed)
+	results, passed = runCheck(db_fname, args.queries, args.draws, args.seed, args.alpha, backend=args.backend, \
+		sampler=args.sampler, scoring=args.scoring)
+	print('{:<48}{:>12}{:>6}{:>12}'.format('parameters', 'chi-square', 'dof', 'p value'))
+	for params, statistic, dof, p_value in results:
+		print('{:<48}{:>12.2f}{:>6}{:>12.4f}'.format(' '.join(str(value) for value in params), statistic, dof, p_value))
+	if not (passed):
+		print('\nFAILED: exclude sampling differs from rejection sampling at alpha {}'.format(args.alpha))
+		sys.exit(1)
+	print('\nPassed: exclude sampling matches rejection sampling at alpha {}'.format(args.alpha))
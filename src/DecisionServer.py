@@ -0,0 +1,406 @@
+#
+#    ___          _     _            __  ___     __          	 /\_______/\
+#   / _ \___ ____(_)__ (_)__  ___   /  |/  /__ _/ /_____ ____ 	 /_  ___   \
+#  / // / -_) __/ (_-</ / _ \/ _ \ / /|_/ / _ `/  '_/ -_) __/	/ @\/ @ \   \
+# /____/\__/\__/_/___/_/\___/_//_//_/  /_/\_,_/_/\_\\__/_/   	\__/\___/   /
+#																 \_\/______/
+#  DecisionServer.py											 /     /\\\\\ 
+#  Dylan Everingham for Marissa Kohan							|      \\\\\\\ 
+#																 \      \\\\\\\ 
+#																  \______/\\\\\
+#																	_||_||_
+
+
+#
+# Asyncio network front end for DecisionMaker app backend, usable without the GUI
+# Clients send Parameters over TCP or a Unix socket, either as JSON lines or as binary frames,
+#	and may pipeline any number of requests. Requests arriving together are scored in one batch, on a
+#	worker thread so that the event loop keeps reading and answering other connections meanwhile
+# Run with: python DecisionServer.py [--host HOST] [--port PORT] [--unix PATH] [--db DB_PATH]
+
+# Dependencies
+import json
+import struct
+import signal
+import asyncio
+import argparse
+import functools
+import collections
+import concurrent.futures
+from DecisionMaker import *
+
+# Constants
+DEFAULT_DB_PATH = '../data/Possibilities.csv'
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+# Maximum number of requests scored in one batch
+DEFAULT_MAX_BATCH = 256
+
+# Seconds to wait for more requests before scoring a batch. 0 batches whatever arrived in the same
+#	event loop iteration, e.g. everything in one read from a pipelining client
+DEFAULT_BATCH_DELAY = 0.0
+
+# Maximum number of named sessions kept. The least recently used ones are forgotten first
+MAX_SESSIONS = 10000
+
+# Seconds to wait for in flight requests to be answered on shutdown
+DEFAULT_SHUTDOWN_TIMEOUT = 5.0
+
+# Binary frames. All little endian
+#	request: magic, request id, session (0 for the connection's own session), one int16 per parameter
+#	response: magic, request id, status (0 ok, 1 error), payload length, then the utf-8 decision or error
+# JSON requests are one object per line, {"id": ..., "session": ..., "params": [...] or {field: value}},
+#	answered by one line of {"id": ..., "decision": ...} or {"id": ..., "error": ...}
+# Responses on a connection are always sent in the order of its requests
+BINARY_MAGIC = 0xDC
+BINARY_REQUEST = struct.Struct('<BII{}h'.format(len(Parameter_Fields)))
+BINARY_RESPONSE = struct.Struct('<BIBH')
+
+# Function to read a Parameters from a JSON request
+# Arguments:
+#	params: list of values in Parameter_Fields order, or dict of values by field name
+# Return values:
+#	params: Parameters. Raises ValueError if any value is missing, not an int, or out of the int16 range
+#		of binary frames
+def parseJsonParams(params):
+	if isinstance(params, dict):
+		missing = [field for field in Parameter_Fields if (field not in params)]
+		if (len(missing) > 0):
+			raise ValueError('Missing parameters {}'.format(missing))
+		params = [params[field] for field in Parameter_Fields]
+	if not isinstance(params, list) or (len(params) != len(Parameter_Fields)):
+		raise ValueError('Expected {} parameters'.format(len(Parameter_Fields)))
+	if not all((type(value) is int) for value in params):
+		raise ValueError('Parameters must be ints')
+	if not all((-0x8000 <= value <= 0x7FFF) for value in params):
+		raise ValueError('Parameters must be in range [-32768 32767]')
+	return Parameters(*params)
+
+# Function to encode a response
+# Arguments:
+#	request_id: id of the request being answered
+#	binary: true to encode a binary frame, false for a JSON line
+#	decision: decision message, or None if there was an error
+#	error: error message, or None
+# Return values:
+#	response: bytes to send
+def encodeResponse(request_id, binary, decision, error=None):
+	if (binary):
+		payload = (error if (decision is None) else decision).encode('utf-8')[:0xFFFF]
+		return BINARY_RESPONSE.pack(BINARY_MAGIC, request_id, int(decision is None), len(payload)) + payload
+	response = {'id': request_id, 'decision': decision} if (decision is not None) else \
+		{'id': request_id, 'error': error}
+	return json.dumps(response).encode('utf-8') + b'\n'
+
+# DecisionServer object
+# Serves decisions from a DecisionMaker over TCP or Unix sockets.
+# Each connection has its own session, unless its requests name one. Named sessions are shared
+#	between connections, so a client can reconnect and keep its last decision
+class DecisionServer:
+
+	# DecisionServer class constructor
+	# Arguments:
+	#	decision_maker: DecisionMaker whose database is served
+	#	max_batch: maximum number of requests scored in one batch
+	#	batch_delay: seconds to wait for more requests before scoring a batch
+	def __init__(self, decision_maker, max_batch=DEFAULT_MAX_BATCH, batch_delay=DEFAULT_BATCH_DELAY):
+		self.decisionMaker = decision_maker
+		self.maxBatch = max_batch
+		self.batchDelay = batch_delay
+
+		# Requests waiting to be scored, as (params, session, future)
+		self.pending = []
+		self.flushHandle = None
+
+		# Batches are scored one at a time in the order they were flushed, so each session's decisions
+		#	are made in the order of its requests
+		self.scorer = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix='DecisionServerScorer')
+
+		# Named sessions, least recently used first
+		self.sessions = collections.OrderedDict()
+
+		# Listening servers, and open connections' handler and reader tasks
+		self.servers = []
+		self.connections = set()
+		self.readers = set()
+		self.closing = False
+
+		# Request and batch counters
+		self.numRequests = 0
+		self.numBatches = 0
+
+	# Function to start listening. Can be called more than once, e.g. for both TCP and a Unix socket
+	# Arguments:
+	#	host, port: address to listen on with TCP
+	#	path: path of Unix socket to listen on instead
+	async def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT, path=None):
+		if (path is not None):
+			server = await asyncio.start_unix_server(self.handleConnection, path)
+		else:
+			server = await asyncio.start_server(self.handleConnection, host, port)
+		self.servers.append(server)
+		return server
+
+	# Function to stop accepting connections and requests, answer the requests already read,
+	#	then close all connections
+	# Arguments:
+	#	timeout: seconds to wait for connections to finish, after which they are closed anyway
+	async def shutdown(self, timeout=DEFAULT_SHUTDOWN_TIMEOUT):
+		self.closing = True
+		for server in self.servers:
+			server.close()
+		for reader in list(self.readers):
+			reader.cancel()
+		self.flush()
+		if (len(self.connections) > 0):
+			done, not_done = await asyncio.wait(list(self.connections), timeout=timeout)
+			for connection in not_done:
+				connection.cancel()
+		for server in self.servers:
+			await server.wait_closed()
+		self.servers = []
+		self.scorer.shutdown(wait=False)
+
+	# Function to get the session with some key
+	# Arguments:
+	#	key: session key
+	# Return values:
+	#	session: DecisionSession
+	def getSession(self, key):
+		session = self.sessions.get(key)
+		if (session is None):
+			session = self.decisionMaker.session()
+			self.sessions[key] = session
+			if (len(self.sessions) > MAX_SESSIONS):
+				self.sessions.popitem(last=False)
+		else:
+			self.sessions.move_to_end(key)
+		return session
+
+	# Function to queue some Parameters to be scored in the next batch
+	# Arguments:
+	#	params: Parameters
+	#	session: DecisionSession the decision is made in
+	# Return values:
+	#	future: asyncio Future resolving to the decision message
+	def submit(self, params, session):
+		future = asyncio.get_running_loop().create_future()
+		self.pending.append((params, session, future))
+		self.numRequests += 1
+		if (len(self.pending) >= self.maxBatch):
+			self.flush()
+		elif (self.flushHandle is None):
+			if (self.batchDelay > 0):
+				self.flushHandle = asyncio.get_running_loop().call_later(self.batchDelay, self.flush)
+			else:
+				self.flushHandle = asyncio.get_running_loop().call_soon(self.flush)
+		return future
+
+	# Function to send all queued Parameters to the scoring thread as one batch
+	def flush(self):
+		if (self.flushHandle is not None):
+			self.flushHandle.cancel()
+			self.flushHandle = None
+		batch, self.pending = self.pending, []
+		if (len(batch) == 0):
+			return
+		self.numBatches += 1
+
+		scored = asyncio.get_running_loop().run_in_executor(self.scorer, self.scoreBatch, batch)
+		scored.add_done_callback(functools.partial(self.resolveBatch, batch))
+
+	# Function to score a batch of Parameters in one pass, and make their decisions in order.
+	#	Runs on the scoring thread. If the batch can't be scored in one pass, each request is scored
+	#	on its own, so that one bad request only fails itself
+	# Arguments:
+	#	batch: list of (params, session, future)
+	# Return values:
+	#	results: list with one (decision message, None) or (None, exception) per request
+	def scoreBatch(self, batch):
+		database = self.decisionMaker.database
+		try:
+			candidates_batch = [(candidates, None) for candidates in \
+				database.getCandidatesMany([params for params, session, future in batch])]
+		except Exception:
+			candidates_batch = [self.scoreOne(database, params) for params, session, future in batch]
+
+		results = []
+		for (params, session, future), (candidates, error) in zip(batch, candidates_batch):
+			if (error is None):
+				try:
+					results.append((session.makeDecision(candidates, database), None))
+					continue
+				except Exception as decision_error:
+					error = decision_error
+			results.append((None, error))
+		return results
+
+	# Function to score one request's Parameters, catching its error
+	# Arguments:
+	#	database: PossibilityDatabase to score in
+	#	params: Parameters of the request
+	# Return values:
+	#	candidates: Candidates fitting the Parameters, or None if scoring failed
+	#	error: exception raised while scoring, or None
+	def scoreOne(self, database, params):
+		try:
+			return database.getCandidates(params), None
+		except Exception as error:
+			return None, error
+
+	# Function to answer the requests of a batch once it has been scored. Runs on the event loop
+	# Arguments:
+	#	batch: list of (params, session, future)
+	#	scored: future of the scoreBatch call
+	def resolveBatch(self, batch, scored):
+		for i, (params, session, future) in enumerate(batch):
+			if future.done():
+				continue
+			if (scored.cancelled()):
+				future.cancel()
+			elif (scored.exception() is not None):
+				future.set_exception(scored.exception())
+			else:
+				decision, error = scored.result()[i]
+				if (error is None):
+					future.set_result(decision)
+				else:
+					future.set_exception(error)
+
+	# Function to handle one connection until the client closes it or the server shuts down
+	# Arguments:
+	#	reader, writer: asyncio streams of the connection
+	async def handleConnection(self, reader, writer):
+		connection = asyncio.current_task()
+		self.connections.add(connection)
+		responses = asyncio.Queue()
+		responder = asyncio.ensure_future(self.writeResponses(responses, writer))
+		read_task = asyncio.ensure_future(self.readRequests(reader, responses, self.decisionMaker.session()))
+		self.readers.add(read_task)
+		try:
+			await read_task
+		except (asyncio.CancelledError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+			# Client went away, sent a line over the stream limit, or the server is shutting down
+			pass
+		finally:
+			self.readers.discard(read_task)
+			try:
+				# Answer everything read so far
+				await responses.put(None)
+				await responder
+			except (asyncio.CancelledError, ConnectionError):
+				responder.cancel()
+			writer.close()
+			self.connections.discard(connection)
+
+	# Function to read requests from a connection, and queue their responses in order
+	# Arguments:
+	#	reader: asyncio stream to read requests from
+	#	responses: queue of (request_id, binary, future) to put responses in
+	#	connection_session: DecisionSession of requests which don't name one
+	async def readRequests(self, reader, responses, connection_session):
+		while not self.closing:
+			first = await reader.read(1)
+			if (len(first) == 0):
+				return
+
+			# Binary frame
+			if (first[0] == BINARY_MAGIC):
+				frame = first + await reader.readexactly(BINARY_REQUEST.size - 1)
+				fields = BINARY_REQUEST.unpack(frame)
+				request_id, session = fields[1], fields[2]
+				session = connection_session if (session == 0) else self.getSession(str(session))
+				await responses.put((request_id, True, self.submit(Parameters(*fields[3:]), session)))
+				continue
+
+			# JSON line
+			line = first + await reader.readline()
+			if (len(line.strip()) == 0):
+				continue
+			request_id = None
+			try:
+				request = json.loads(line)
+				if not isinstance(request, dict):
+					raise ValueError('Request must be a JSON object')
+				request_id = request.get('id')
+				params = parseJsonParams(request.get('params'))
+				session = connection_session if (request.get('session') is None) else \
+					self.getSession(str(request['session']))
+			except ValueError as error:
+				future = asyncio.get_running_loop().create_future()
+				future.set_exception(error)
+			else:
+				future = self.submit(params, session)
+			await responses.put((request_id, False, future))
+
+	# Function to write responses to a connection in the order their requests were read
+	# Arguments:
+	#	responses: queue of (request_id, binary, future), ended by None
+	#	writer: asyncio stream to write responses to
+	async def writeResponses(self, responses, writer):
+		while True:
+			response = await responses.get()
+			if (response is None):
+				break
+			request_id, binary, future = response
+			try:
+				data = encodeResponse(request_id, binary, await future)
+			except Exception as error:
+				data = encodeResponse(request_id, binary, None, str(error))
+			writer.write(data)
+
+			# Only wait for the socket when there's nothing else ready to send
+			if (responses.empty()):
+				await writer.drain()
+		await writer.drain()
+
+	# Function to get server statistics
+	# Arguments:
+	#	None
+	# Return values:
+	#	stats: dict of request, batch, connection and session counts
+	def getStats(self):
+		return {
+			'requests': self.numRequests,
+			'batches': self.numBatches,
+			'connections': len(self.connections),
+			'sessions': len(self.sessions)
+		}
+
+# Function to run a server until SIGINT or SIGTERM, then shut it down gracefully
+# Arguments:
+#	decision_maker: DecisionMaker to serve
+#	host, port, path: see DecisionServer.start
+#	options: other DecisionServer keyword arguments
+async def serve(decision_maker, host=DEFAULT_HOST, port=DEFAULT_PORT, path=None, **options):
+	server = DecisionServer(decision_maker, **options)
+	await server.start(host, port, path)
+
+	stop = asyncio.Event()
+	loop = asyncio.get_running_loop()
+	for sig in (signal.SIGINT, signal.SIGTERM):
+		try:
+			loop.add_signal_handler(sig, stop.set)
+		except (NotImplementedError, RuntimeError):
+			# Not supported on Windows, where KeyboardInterrupt still stops the loop
+			pass
+	await stop.wait()
+	await server.shutdown()
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Serve DecisionMaker decisions over TCP or a Unix socket')
+	parser.add_argument('--db', default=DEFAULT_DB_PATH, help='database file')
+	parser.add_argument('--host', default=DEFAULT_HOST)
+	parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+	parser.add_argument('--unix', default=None, help='listen on this Unix socket instead of TCP')
+	parser.add_argument('--max-batch', type=int, default=DEFAULT_MAX_BATCH)
+	parser.add_argument('--batch-delay', type=float, default=DEFAULT_BATCH_DELAY)
+	parser.add_argument('--watch', action='store_true', help='reload the database when its file changes')
+	args = parser.parse_args()
+
+	decision_maker = DecisionMaker(args.db)
+	if (args.watch):
+		decision_maker.watch()
+	asyncio.run(serve(decision_maker, args.host, args.port, args.unix, max_batch=args.max_batch, \
+		batch_delay=args.batch_delay))
@@ -14,13 +14,14 @@
 # Contains all GUI elements
 
 # Dependencies
-import sys
 import time
+start_time = time.perf_counter()
+import sys
 import ctypes
-from PyQt5.QtCore import Qt, QTimer, QTime
+from PyQt5.QtCore import Qt, QTimer, QTime, QDate, QObject, QRunnable, QThreadPool, pyqtSignal
 from PyQt5.QtWidgets import QApplication, QWidget, QMainWindow, \
 	QDesktopWidget, QVBoxLayout, QHBoxLayout, QPushButton, QSlider, \
-	QGridLayout, QLabel, QFrame, QCalendarWidget, QComboBox, QLayout
+	QGridLayout, QLabel, QFrame, QCalendarWidget, QComboBox, QLayout, QProgressBar
 from PyQt5.QtGui import QIcon, QPixmap, QPalette
 from DecisionMaker import *
 
@@ -34,20 +35,32 @@ VERSION = '0.0.1'
 LOAD_ANIM_FRAME_NUM = 20
 LOAD_ANIM_FRAME_DELAY = 100
 
-# Makes the taskbar icon work (thanks StackOverflow)
+# Milliseconds the controls must stay unchanged before the decision is prepared in the background
+PREPARE_DELAY = 150
+
+# Makes the taskbar icon work (thanks StackOverflow). Windows only
 appid = 'decisionmaker.0.0.1'
-ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID(appid)
+if (sys.platform == 'win32'):
+	ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID(appid)
 
 # DecisionMakerWindow class
 # Defines QtWidget representing DecisionMaker GUI window
+# Starts up in stages, so the window appears as soon as possible: the window is shown first, and once
+#	it's painted the backend is loaded on a worker thread while the images and calendar are added.
+#	DECIDE is enabled when the backend is loaded. Startup timings are written to stderr
 class DecisionMakerWindow(QMainWindow):
 	# DecisionMakerWindow class constructor
 	def __init__(self):
 		# Call supercalss constructor
 		super().__init__()
 
-		# Initialize backend
-		self.decision_maker = DecisionMaker(DEFAULT_DB_PATH)
+		# The backend is loaded after the window is first painted, see finishStartup. Not on the global
+		#	thread pool: Qt waits on it to convert images, and with one CPU its only thread would be
+		#	the loader, waiting for the GIL held by the waiting GUI thread
+		self.decision_maker = None
+		self.first_paint_time = None
+		self.load_pool = QThreadPool(self)
+		self.load_pool.setMaxThreadCount(1)
 
 		# These parameter values get adjusted by the front panel controls
 		self.day = 0
@@ -61,9 +74,23 @@ class DecisionMakerWindow(QMainWindow):
 		self.energy_level = 0
 		self.introvert_level = 0
 		self.stress_level = 0
+
+		# Prepares the decision once the parameters stop changing, see paramsChanged
+		self.prepare_timer = QTimer()
+		self.prepare_timer.setSingleShot(True)
+		self.prepare_timer.setInterval(PREPARE_DELAY)
+		self.prepare_timer.timeout.connect(self.prepareDecision)
 		
-		# Status bar
-		#self.statusBar().showMessage('Ready')
+		# Status bar, showing progress while the backend loads
+		self.progress_bar = QProgressBar()
+		self.progress_bar.setRange(0, 0)
+		self.progress_bar.setMaximumWidth(150)
+		self.statusBar().addPermanentWidget(self.progress_bar)
+		self.statusBar().showMessage('Loading possibilities...')
+		self.statusBar().setAutoFillBackground(True)
+		palette = self.statusBar().palette()
+		palette.setColor(self.statusBar().backgroundRole(), Qt.white)
+		self.statusBar().setPalette(palette)
 
 		# Menu bar
 		#menu_bar = self.menuBar()
@@ -74,6 +101,9 @@ class DecisionMakerWindow(QMainWindow):
 		title = DecisionMakerTitle()
 		controls = DecisionMakerControls(self)
 		output = DecisionMakerOutput(self)
+		self.title = title
+		self.controls = controls
+		self.output = output
 		vbox.addWidget(title)
 		vbox.addWidget(controls)
 		vbox.addWidget(output)
@@ -103,34 +133,121 @@ class DecisionMakerWindow(QMainWindow):
 		#window_geom.moveCenter(center_pos)
 		#self.move(window_geom.topLeft())
 		self.setWindowTitle('DecisionMaker')
-		self.setWindowIcon(QIcon(ICON_PATH))
 
 		# Show window
 		self.show()
 
+	# Paint event handler. The first paint starts the rest of the startup
+	def paintEvent(self, event):
+		super().paintEvent(event)
+		if (self.first_paint_time is None):
+			self.first_paint_time = time.perf_counter()
+			sys.stderr.write('first paint {:.3f}s\n'.format(self.first_paint_time - start_time))
+			QTimer.singleShot(0, self.finishStartup)
+
+	# Function to start loading the backend, and add the parts of the window which weren't needed
+	#	for the first paint while it loads
+	def finishStartup(self):
+		task = DecisionMakerLoadTask(DEFAULT_DB_PATH)
+		task.signals.loaded.connect(self.decisionMakerLoaded)
+		task.signals.failed.connect(self.decisionMakerFailed)
+		self.load_pool.start(task)
+
+		self.setWindowIcon(QIcon(ICON_PATH))
+		self.title.loadImage()
+		self.controls.addCalendar()
+
+	# Function to receive the backend from the worker thread loading it
+	# Arguments:
+	#	decision_maker: loaded DecisionMaker
+	#	load_time: seconds spent loading it
+	def decisionMakerLoaded(self, decision_maker, load_time):
+		# Pick up edits to the database without restarting
+		self.decision_maker = decision_maker
+		self.decision_maker.watch()
+
+		ready_time = time.perf_counter()
+		sys.stderr.write('ready {:.3f}s (loaded {} possibilities in {:.3f}s)\n'.format(ready_time - start_time, \
+			len(decision_maker.possibilities), load_time))
+		if (decision_maker.loadReport.num_rejected > 0):
+			sys.stderr.write(decision_maker.loadReport.getSummary() + '\n')
+
+		self.statusBar().removeWidget(self.progress_bar)
+		self.statusBar().showMessage('Ready')
+		self.output.setLoaded()
+		self.prepareDecision()
+
+	# Function to receive an error from the worker thread loading the backend. DECIDE stays disabled
+	# Arguments:
+	#	error_str: error message
+	def decisionMakerFailed(self, error_str):
+		sys.stderr.write('loading failed after {:.3f}s: {}\n'.format(time.perf_counter() - start_time, error_str))
+		self.statusBar().removeWidget(self.progress_bar)
+		self.statusBar().showMessage('Couldn\'t load possibilities')
+		self.output.setLoaded(error_str)
+
 	# Setters for parameter values, triggered by changing front panel controls
 	def setHungerLevel(self, level):
 		self.hunger_level = level
+		self.paramsChanged()
 	def setThirstLevel(self, level):
 		self.thirst_level = level
+		self.paramsChanged()
 	def setEnergyLevel(self, level):
 		self.energy_level = level
+		self.paramsChanged()
 	def setIntrovertLevel(self, level):
 		self.introvert_level = level
+		self.paramsChanged()
 	def setStressLevel(self, level):
 		self.stress_level = level
+		self.paramsChanged()
 	def setDay(self, day):
 		self.day = day
+		self.paramsChanged()
 	def setYear(self, year):
 		self.year = year
+		self.paramsChanged()
 	def setTime(self, time):
 		self.time = time
+		self.paramsChanged()
 	def setWeather(self, weather):
 		self.weather = weather
+		self.paramsChanged()
 	def setAlone(self, alone):
 		self.alone = alone
+		self.paramsChanged()
 	def setRetrograde(self, retrograde):
 		self.retrograde = retrograde
+		self.paramsChanged()
+
+	# Function called whenever a parameter value changes. Restarts the wait before preparing the decision,
+	#	so dragging a slider only prepares the value it stops on
+	def paramsChanged(self):
+		self.prepare_timer.start()
+
+	# Function to start filtering and scoring the Possibilities under the current parameters in the
+	#	background, so that DECIDE only has to draw one of them
+	def prepareDecision(self):
+		if (self.decision_maker is None):
+			return
+		self.output.prepareDecision(self.getParams())
+
+	# Function to get Parameters from the current parameter values
+	def getParams(self):
+		return Parameters(*tuple(
+			[self.day, \
+			 self.year, \
+			 self.time, \
+			 self.weather, \
+			 self.alone, \
+			 self.hunger_level, \
+			 self.thirst_level, \
+			 self.energy_level, \
+			 self.introvert_level, \
+			 self.stress_level, \
+			 self.retrograde]
+		))
 
 # DecisionMakerTitle class definition
 # Widget conatining application title bar
@@ -140,11 +257,10 @@ class DecisionMakerTitle(QWidget):
 		# Call superclass constructor
 		super().__init__()
 
-		# Title image
-		title_image = QLabel()
-		pixmap = QPixmap(TITLE_IMAGE_PATH)
-		title_image.setPixmap(pixmap)
+		# Title image. Shows the title as text until the image is loaded, see loadImage
+		title_image = QLabel('DecisionMaker')
 		title_image.setAlignment(Qt.AlignLeft | Qt.AlignBottom)
+		self.title_image = title_image
 
 		# Author
 		title_author = QLabel(AUTHOR, self)
@@ -163,6 +279,11 @@ class DecisionMakerTitle(QWidget):
 
 		self.setLayout(hbox)
 
+	# Function to load the title image
+	def loadImage(self):
+		pixmap = QPixmap(TITLE_IMAGE_PATH)
+		self.title_image.setPixmap(pixmap)
+
 # DecisionMakerControls class definition
 # Widget containing all input controls for DecisionMaker
 class DecisionMakerControls(QWidget):
@@ -194,16 +315,12 @@ class DecisionMakerControls(QWidget):
 		# Box containing controls in lower right box
 		#lowerright_control_box = QVBoxLayout()
 
-		# Calendar control
-		self.calendar = QCalendarWidget()
-		self.calendar.setHorizontalHeaderFormat(QCalendarWidget.SingleLetterDayNames)
-		self.calendar.setVerticalHeaderFormat(QCalendarWidget.NoVerticalHeader)
-		self.calendar.selectionChanged.connect(self.calendarChanged)
-		self.calendar.setFixedWidth(325)
-		right_box.addWidget(self.calendar)
+		# Calendar control. Added after the window is first painted, see addCalendar
+		self.calendar = None
+		self.right_box = right_box
 
 		# Save today's date
-		self.today = self.calendar.selectedDate()
+		self.today = QDate.currentDate()
 
 		# Initialize day and year
 		self.parent.setDay(self.today.dayOfWeek() - 1)
@@ -293,6 +410,16 @@ class DecisionMakerControls(QWidget):
 		hbox.setSizeConstraint(QLayout.SetFixedSize)
 		self.setLayout(hbox)
 
+	# Function to add the calendar control, which starts out with today selected
+	def addCalendar(self):
+		self.calendar = QCalendarWidget()
+		self.calendar.setHorizontalHeaderFormat(QCalendarWidget.SingleLetterDayNames)
+		self.calendar.setVerticalHeaderFormat(QCalendarWidget.NoVerticalHeader)
+		self.calendar.setSelectedDate(self.today)
+		self.calendar.selectionChanged.connect(self.calendarChanged)
+		self.calendar.setFixedWidth(325)
+		self.right_box.insertWidget(0, self.calendar)
+
 	# Button event handler
 	def buttonClicked(self):
 		sender = self.sender()
@@ -361,6 +488,9 @@ class DecisionMakerOutput(QWidget):
 		self.button_decide.setFixedWidth(225)
 		leftbox.addWidget(self.button_decide)
 
+		# Disabled until the backend is loaded, see setLoaded
+		self.button_decide.setEnabled(False)
+
 		# Box conatining output display and label
 		rightbox = QHBoxLayout()
 
@@ -370,7 +500,7 @@ class DecisionMakerOutput(QWidget):
 		rightbox.addWidget(result_label)
 
 		# Result display
-		result_str = "Select some parameters and hit 'DECIDE'"
+		result_str = 'Loading possibilities...'
 		self.result_display = QLabel(result_str, self)
 		self.result_display.setAlignment(Qt.AlignCenter)
 		self.result_display.setFrameStyle(QFrame.Panel | QFrame.Sunken)
@@ -383,6 +513,13 @@ class DecisionMakerOutput(QWidget):
 		self.anim_timer.timeout.connect(self.doOutput)
 		self.frame_count = 0
 
+		# Decisions are made on a worker thread while the animation plays. One at a time, so each
+		#	decision still avoids the one before it. Results of all but the latest request are dropped
+		self.thread_pool = QThreadPool(self)
+		self.thread_pool.setMaxThreadCount(1)
+		self.request_id = 0
+		self.result_str = None
+
 		# Color palettes
 		self.setAutoFillBackground(True)
 		palette = self.palette()
@@ -397,29 +534,11 @@ class DecisionMakerOutput(QWidget):
 		hbox.setSizeConstraint(QLayout.SetFixedSize)
 		self.setLayout(hbox)
 
-	# Function to do loading animation
+	# Function to do loading animation. Keeps going until the decision is ready
 	def doOutput(self):
-		if (self.frame_count > LOAD_ANIM_FRAME_NUM):
-			# Construct Parameters and make a decision
-			params = Parameters(*tuple(
-				[self.parent.day, \
-				 self.parent.year, \
-				 self.parent.time, \
-				 self.parent.weather, \
-				 self.parent.alone, \
-				 self.parent.hunger_level, \
-				 self.parent.thirst_level, \
-				 self.parent.energy_level, \
-				 self.parent.introvert_level, \
-				 self.parent.stress_level, \
-				 self.parent.retrograde]
-			))
-
-			# Get decision
-			result_str = "{}".format(self.parent.decision_maker.choose(params))
-
+		if (self.frame_count > LOAD_ANIM_FRAME_NUM) and (self.result_str is not None):
 			# Display result
-			self.result_display.setText(result_str)
+			self.result_display.setText(self.result_str)
 
 			# Reset animation frame counter and stop timer
 			self.frame_count = 0
@@ -441,13 +560,134 @@ class DecisionMakerOutput(QWidget):
 		# Increment animation frame counter
 		self.frame_count += 1
 
+	# Function to enable DECIDE once the backend is loaded
+	# Arguments:
+	#	error_str: error message if loading failed, in which case DECIDE stays disabled
+	def setLoaded(self, error_str=None):
+		if (error_str is not None):
+			self.result_display.setText('Error: {}'.format(error_str))
+			return
+		self.result_display.setText('Select some parameters and hit \'DECIDE\'')
+		self.button_decide.setEnabled(True)
+
+	# Function to receive a decision from the worker thread
+	# Arguments:
+	#	request_id: id of the request the decision was made for
+	#	result_str: decision, or error message
+	def decisionFinished(self, request_id, result_str):
+		# Ignore late results of requests which were replaced by a newer one
+		if (request_id != self.request_id):
+			return
+		self.result_str = result_str
+
+	# Function to prepare a decision on the worker thread, see DecisionMaker.prepare
+	# Arguments:
+	#	params: Parameters to prepare the decision under
+	def prepareDecision(self, params):
+		self.thread_pool.start(DecisionMakerPrepareTask(self.parent.decision_maker, params))
+
 	# Button event handler
 	def buttonClicked(self):
 		sender = self.sender()
 		if (sender == self.button_decide):
-			# Start loading animation, will display decisoin when finished
+			# Replace any earlier request or preparation. If it hasn't started yet, it's dropped
+			self.request_id += 1
+			self.result_str = None
+			self.frame_count = 0
+			self.thread_pool.clear()
+
+			# Start making the decision, using the parameters as they are now
+			task = DecisionMakerTask(self.parent.decision_maker, self.parent.getParams(), self.request_id)
+			task.signals.finished.connect(self.decisionFinished)
+			self.thread_pool.start(task)
+
+			# Start loading animation, will display decision when finished
 			self.anim_timer.start(LOAD_ANIM_FRAME_DELAY)
 
+# DecisionMakerTaskSignals class definition
+# Signals of DecisionMakerTask. QRunnable isn't a QObject, so it can't have signals itself
+class DecisionMakerTaskSignals(QObject):
+	# Emitted with the request id and the decision, or an error message
+	finished = pyqtSignal(int, str)
+
+# DecisionMakerTask class definition
+# Makes one decision on a worker thread, and sends it back to the GUI thread with a signal
+class DecisionMakerTask(QRunnable):
+	# DecisionMakerTask class constructor
+	# Arguments:
+	#	decision_maker: DecisionMaker to choose with
+	#	params: Parameters to choose under
+	#	request_id: id sent back with the decision
+	def __init__(self, decision_maker, params, request_id):
+		# Call superclass constructor
+		super().__init__()
+
+		self.decision_maker = decision_maker
+		self.params = params
+		self.request_id = request_id
+		self.signals = DecisionMakerTaskSignals()
+
+	# Function run on the worker thread
+	def run(self):
+		try:
+			result_str = "{}".format(self.decision_maker.choose(self.params))
+		except Exception as error:
+			result_str = 'Error: {}'.format(error)
+		self.signals.finished.emit(self.request_id, result_str)
+
+# DecisionMakerPrepareTask class definition
+# Prepares a decision on a worker thread, see DecisionMaker.prepare
+class DecisionMakerPrepareTask(QRunnable):
+	# DecisionMakerPrepareTask class constructor
+	# Arguments:
+	#	decision_maker: DecisionMaker to prepare with
+	#	params: Parameters to prepare the decision under
+	def __init__(self, decision_maker, params):
+		# Call superclass constructor
+		super().__init__()
+
+		self.decision_maker = decision_maker
+		self.params = params
+
+	# Function run on the worker thread. Errors are left for the decision itself to report
+	def run(self):
+		try:
+			self.decision_maker.prepare(self.params)
+		except Exception:
+			pass
+
+# DecisionMakerLoadTaskSignals class definition
+# Signals of DecisionMakerLoadTask
+class DecisionMakerLoadTaskSignals(QObject):
+	# Emitted with the loaded DecisionMaker and the seconds spent loading it
+	loaded = pyqtSignal(object, float)
+
+	# Emitted with an error message if loading failed
+	failed = pyqtSignal(str)
+
+# DecisionMakerLoadTask class definition
+# Loads the backend on a worker thread, and sends it to the GUI thread with a signal
+class DecisionMakerLoadTask(QRunnable):
+	# DecisionMakerLoadTask class constructor
+	# Arguments:
+	#	db_fname: name of the database file
+	def __init__(self, db_fname):
+		# Call superclass constructor
+		super().__init__()
+
+		self.db_fname = db_fname
+		self.signals = DecisionMakerLoadTaskSignals()
+
+	# Function run on the worker thread
+	def run(self):
+		start = time.perf_counter()
+		try:
+			decision_maker = DecisionMaker(self.db_fname)
+		except Exception as error:
+			self.signals.failed.emit('{}'.format(error))
+			return
+		self.signals.loaded.emit(decision_maker, time.perf_counter() - start)
+
 # DecisionMakerSlider class definition
 # Widget conatining slider and labels
 class DecisionMakerSlider(QWidget):